@@ -96,5 +96,11 @@ from kod import (
     comments,
     sync_tracks,
     admin_all_users,
-    user_statistics
+    user_statistics,
+    track_points,
+    batch_upload,
+    compression,
+    strava_webhook,
+    scheduler,
+    benchmark_sync
 )
@@ -4,6 +4,8 @@ from flask_login import current_user
 from functools import wraps
 
 from kod.models import Track, User
+from kod.track_points import delete_track_points
+from kod.challenges import invalidate_daily_distances
 
 def admin_required(f):
     @wraps(f)
@@ -44,8 +46,11 @@ def all_tracks():
 def delete_track(track_id):
     track = Track.query.get(track_id)
     if track:
+        user_id = track.user_id
         db.session.delete(track)
         db.session.commit()
+        delete_track_points(track_id)
+        invalidate_daily_distances([user_id])
         flash('Трек успешно удален.', 'success')
     else:
         flash('Трек не найден.', 'danger')
@@ -73,6 +78,9 @@ def delete_tracks():
     for track in tracks_to_delete:
         db.session.delete(track)
     db.session.commit()
+    for track in tracks_to_delete:
+        delete_track_points(track.id)
+    invalidate_daily_distances(track.user_id for track in tracks_to_delete)
 
     flash(f'{len(tracks_to_delete)} треков успешно удалено.', 'success')
     return redirect(url_for('all_tracks'))
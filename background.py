@@ -0,0 +1,172 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import threading
+import logging
+import uuid
+
+from sqlalchemy import select
+
+from kod import app, db
+from kod.models import BackgroundJob
+
+# Общий пул фоновых задач приложения (обработка загрузок и т.п.)
+executor = ThreadPoolExecutor(
+    max_workers=app.config['BACKGROUND_WORKERS'],
+    thread_name_prefix='kod-background'
+)
+
+# Состояние задач хранится в таблице background_job, а не в памяти процесса:
+# статус задачи, запущенной одним воркером gunicorn, запрашивается у любого другого.
+# Запись идёт отдельными короткими транзакциями, не затрагивая db.session вызывающего кода.
+_jobs = BackgroundJob.__table__
+
+# Id задачи, выполняемой текущим потоком пула (см. current_job_id)
+_current = threading.local()
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+def _update_job(job_id, **fields):
+    with db.engine.begin() as connection:
+        connection.execute(_jobs.update().where(_jobs.c.id == job_id).values(**fields))
+
+
+def _job_cutoff():
+    return datetime.utcnow() - timedelta(seconds=app.config['BACKGROUND_JOB_TTL'])
+
+
+def _cleanup_jobs(connection):
+    """
+    Удаляет задачи старше BACKGROUND_JOB_TTL секунд: завершённые — по времени завершения,
+    а так и не завершённые (процесс остановлен посреди работы) — по времени создания.
+    """
+    cutoff = _job_cutoff()
+    connection.execute(_jobs.delete().where(
+        (_jobs.c.finished_at < cutoff) | (_jobs.c.finished_at.is_(None) & (_jobs.c.created_at < cutoff))
+    ))
+
+
+def _job_from_row(row):
+    """
+    Задача из строки таблицы. Задача в очереди или в работе старше BACKGROUND_JOB_TTL
+    считается упавшей: выполнявший её процесс был остановлен, и статус уже не изменится.
+    """
+    if not row:
+        return None
+    job = dict(row)
+    if job['status'] in ACTIVE_STATUSES and job['created_at'] < _job_cutoff():
+        job['status'] = 'failed'
+        job['error'] = 'Задача прервана: процесс, выполнявший её, был остановлен'
+    return job
+
+
+def _run_job(job_id, func, args, kwargs):
+    with app.app_context():
+        if is_cancel_requested(job_id):
+            _update_job(job_id, status='cancelled', finished_at=datetime.utcnow())
+            return
+
+        _update_job(job_id, status='running', started_at=datetime.utcnow())
+        _current.job_id = job_id
+        try:
+            result = func(*args, **kwargs)
+            status = 'cancelled' if is_cancel_requested(job_id) else 'done'
+            _update_job(job_id, status=status, result=result, finished_at=datetime.utcnow())
+        except Exception as e:
+            db.session.rollback()
+            _update_job(job_id, status='failed', error=str(e), finished_at=datetime.utcnow())
+            logging.error(f"Фоновая задача {func.__name__} ({job_id}) завершилась с ошибкой: {e}", exc_info=True)
+        finally:
+            _current.job_id = None
+            db.session.remove()
+
+
+def submit_job(kind, func, *args, owner_id=None, **kwargs):
+    """
+    Ставит функцию в очередь фоновых задач и сразу возвращает id задачи.
+    Функция выполняется в контексте приложения; её результат (JSON-сериализуемый) сохраняется в задаче.
+    """
+    job_id = uuid.uuid4().hex
+    with db.engine.begin() as connection:
+        _cleanup_jobs(connection)
+        connection.execute(_jobs.insert().values(
+            id=job_id,
+            kind=kind,
+            owner_id=owner_id,
+            status='queued',
+            created_at=datetime.utcnow(),
+            progress={},
+            cancel_requested=False
+        ))
+
+    executor.submit(_run_job, job_id, func, args, kwargs)
+    logging.info(f"Фоновая задача {kind} ({job_id}) поставлена в очередь.")
+    return job_id
+
+
+def get_job(job_id):
+    """Возвращает задачу (dict) по id или None, если её нет (или она уже удалена)."""
+    if not job_id:
+        return None
+    with db.engine.connect() as connection:
+        row = connection.execute(select(_jobs).where(_jobs.c.id == job_id)).mappings().first()
+    return _job_from_row(row)
+
+
+def latest_job(kind, owner_id=None):
+    """Последняя задача данного вида (и владельца, если указан) или None."""
+    query = select(_jobs).where(_jobs.c.kind == kind)
+    if owner_id is not None:
+        query = query.where(_jobs.c.owner_id == owner_id)
+    with db.engine.connect() as connection:
+        row = connection.execute(query.order_by(_jobs.c.created_at.desc()).limit(1)).mappings().first()
+    return _job_from_row(row)
+
+
+def is_active(job):
+    """
+    Задача ещё в очереди или выполняется. Задачи старше BACKGROUND_JOB_TTL активными не считаются:
+    так задача процесса, остановленного посреди работы, не блокирует запуск новой.
+    """
+    if not job or job['status'] not in ACTIVE_STATUSES:
+        return False
+    return job['created_at'] > _job_cutoff()
+
+
+def current_job_id():
+    """Id задачи, внутри которой выполняется код, или None вне фоновой задачи."""
+    return getattr(_current, 'job_id', None)
+
+
+def update_job_progress(progress, job_id=None):
+    """Сохраняет прогресс (dict) текущей задачи."""
+    job_id = job_id or current_job_id()
+    if job_id:
+        _update_job(job_id, progress=progress)
+
+
+def is_cancel_requested(job_id=None):
+    """Запрошена ли отмена задачи (по умолчанию — текущей)."""
+    job_id = job_id or current_job_id()
+    with db.engine.connect() as connection:
+        return bool(connection.execute(
+            select(_jobs.c.cancel_requested).where(_jobs.c.id == job_id)
+        ).scalar())
+
+
+def cancel_job(job_id):
+    """
+    Просит задачу остановиться. Задача в очереди не запустится, а выполняющаяся
+    должна сама проверять is_cancel_requested(). Возвращает False, если задача уже завершена.
+    """
+    if not job_id:
+        return False
+    with db.engine.begin() as connection:
+        updated = connection.execute(
+            _jobs.update()
+            .where(_jobs.c.id == job_id, _jobs.c.status.in_(ACTIVE_STATUSES))
+            .values(cancel_requested=True)
+        ).rowcount
+    if updated:
+        logging.info(f"Запрошена отмена фоновой задачи {job_id}.")
+    return bool(updated)
@@ -0,0 +1,249 @@
+from flask import request, jsonify, url_for
+from flask_login import login_required, current_user
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy.exc import SQLAlchemyError
+from lxml import etree
+import multiprocessing
+import threading
+import tempfile
+import zipfile
+import logging
+import zlib
+import shutil
+import uuid
+import os
+
+from kod import app, db
+from kod.models import Track
+from kod.gpx_parser import iter_trackpoints
+from kod.track_metrics import TrackMetrics
+from kod.background import submit_job
+from kod.track_points import save_track_points
+from kod.tracks import allowed_file, new_track_from_summary, copy_and_hash
+from kod.compression import detect_compression, strip_compression_suffix, open_gpx, DECOMPRESSION_ERRORS
+from kod.challenges import invalidate_daily_distances
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """
+    Пул процессов для параллельного разбора GPX (создаётся при первой пакетной загрузке).
+    Процессы запускаются через spawn: форк из многопоточного веб-процесса небезопасен.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=app.config['BATCH_PARSE_WORKERS'],
+                mp_context=multiprocessing.get_context('spawn')
+            )
+    return _process_pool
+
+
+def parse_gpx_file(path, distance_method, compression=None):
+    """
+    Разбирает один GPX-файл в отдельном процессе.
+    Возвращает итоговые метрики и колонки точек либо текст ошибки.
+    """
+    try:
+        metrics = TrackMetrics(distance_method)
+        with open_gpx(path, compression) as source:
+            for point in iter_trackpoints(source):
+                metrics.add(point)
+
+        if not len(metrics):
+            return {'error': 'Не атрымалася загрузіць трэк.'}
+
+        summary = metrics.finish()
+        return {
+            'error': None,
+            'summary': summary,
+            'lats': metrics.lats,
+            'lons': metrics.lons,
+            'eles': metrics.eles,
+            'times': metrics.epoch_seconds
+        }
+    except etree.XMLSyntaxError as e:
+        return {'error': f'Ошибка парсинга GPX: {str(e)}'}
+    except DECOMPRESSION_ERRORS as e:
+        return {'error': f'Повреждённый сжатый файл: {str(e)}'}
+    except Exception as e:
+        return {'error': f'Произошла ошибка: {str(e)}'}
+
+
+def _save_upload(stream, folder):
+    """Сохраняет поток во временный файл внутри папки пакета и возвращает путь и sha256 файла."""
+    path = os.path.join(folder, f'{uuid.uuid4().hex}.gpx')
+    with open(path, 'wb') as tmp:
+        file_hash = copy_and_hash(stream, tmp)
+    return path, file_hash
+
+
+def _extract_archive(file, tmp_dir, sources, report, unpacked_size):
+    """
+    Распаковывает GPX-файлы из ZIP-архива во временную папку пакета. Файл, который не удалось
+    распаковать (шифрование, неподдерживаемое сжатие, повреждение), попадает в отчёт с ошибкой.
+    Архив целиком отклоняется, если с ним распакованные файлы пакета превысят BATCH_MAX_UNCOMPRESSED_SIZE
+    (ZipFile не отдаёт больше заявленного размера, поэтому проверки заголовков достаточно).
+    Возвращает новый суммарный размер распакованных файлов.
+    """
+    try:
+        with zipfile.ZipFile(file.stream) as archive:
+            members = [
+                member for member in archive.infolist()
+                if not member.is_dir()
+            ]
+            archive_size = sum(member.file_size for member in members if allowed_file(os.path.basename(member.filename)))
+            if unpacked_size + archive_size > app.config['BATCH_MAX_UNCOMPRESSED_SIZE']:
+                report.append({'filename': file.filename, 'status': 'error', 'error': 'Занадта вялікі ZIP-архіў'})
+                return unpacked_size
+
+            for member in members:
+                member_name = os.path.basename(member.filename)
+                if not allowed_file(member_name):
+                    report.append({'filename': member_name, 'status': 'error', 'error': 'Неверный формат файла'})
+                    continue
+                try:
+                    with archive.open(member) as member_stream:
+                        path, file_hash = _save_upload(member_stream, tmp_dir)
+                except (RuntimeError, NotImplementedError, zipfile.BadZipFile, zlib.error, EOFError) as e:
+                    logging.warning(f"Не удалось распаковать {member.filename} из {file.filename}: {e}")
+                    report.append({'filename': member_name, 'status': 'error', 'error': 'Не атрымалася распакаваць файл'})
+                    continue
+                sources.append((strip_compression_suffix(member_name), path, detect_compression(member_name), file_hash))
+            return unpacked_size + archive_size
+    except zipfile.BadZipFile:
+        report.append({'filename': file.filename, 'status': 'error', 'error': 'Пашкоджаны ZIP-архіў'})
+        return unpacked_size
+
+
+@app.route('/upload/batch', methods=['POST'])
+@login_required
+def upload_batch():
+    """Пакетная загрузка: несколько GPX-файлов и/или ZIP-архивы с ними."""
+    files = [file for file in request.files.getlist('files') + request.files.getlist('file') if file.filename]
+    if not files:
+        return jsonify({'error': 'No selected file'}), 400
+
+    tmp_dir = tempfile.mkdtemp(dir=app.config['UPLOAD_TMP_FOLDER'])
+    sources = []  # (имя файла, путь к временной копии, сжатие, sha256 файла)
+    report = []
+
+    # Временную папку удаляет фоновая задача; если до неё не дошло, удаляем здесь
+    try:
+        unpacked_size = 0
+        for file in files:
+            if file.filename.lower().endswith('.zip'):
+                unpacked_size = _extract_archive(file, tmp_dir, sources, report, unpacked_size)
+            elif allowed_file(file.filename):
+                path, file_hash = _save_upload(file.stream, tmp_dir)
+                sources.append((strip_compression_suffix(file.filename), path, detect_compression(file.filename), file_hash))
+            else:
+                report.append({'filename': file.filename, 'status': 'error', 'error': 'Неверный формат файла'})
+
+        job_id = submit_job('upload', process_batch, tmp_dir, sources, report, current_user.id, owner_id=current_user.id)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    logging.info(f"Пакетная загрузка ({len(sources)} файлов) поставлена в очередь как {job_id}.")
+
+    return jsonify({
+        'job_id': job_id,
+        'status_url': url_for('upload_status', job_id=job_id)
+    }), 202
+
+
+def process_batch(tmp_dir, sources, report, user_id):
+    """
+    Фоновая обработка пакета: одна проверка дублей, параллельный разбор на пуле процессов
+    и запись всех новых треков одной транзакцией. Возвращает отчёт по каждому файлу.
+    """
+    try:
+        # Дубли по имени и по байтам файла: одна выборка по индексам до разбора
+        names = [name for name, _, _, _ in sources]
+        file_hashes = [file_hash for _, _, _, file_hash in sources]
+        existing = set()
+        if sources:
+            existing = {
+                value
+                for row in db.session.query(Track.filename, Track.file_hash).filter(
+                    Track.filename.in_(names) | Track.file_hash.in_(file_hashes)
+                )
+                for value in row
+            }
+
+        to_parse = []
+        seen = set()
+        for name, path, compression, file_hash in sources:
+            if name in existing or file_hash in existing or name in seen or file_hash in seen:
+                report.append({'filename': name, 'status': 'skipped', 'error': 'Такі трэк ўжо быў запампаваны! Выберыце іншы!.'})
+                continue
+            seen.update((name, file_hash))
+            to_parse.append((name, path, compression, file_hash))
+
+        pool = get_process_pool()
+        distance_method = app.config['TRACK_DISTANCE_METHOD']
+        futures = [pool.submit(parse_gpx_file, path, distance_method, compression) for _, path, compression, _ in to_parse]
+
+        results = [(name, file_hash, future.result()) for (name, _, _, file_hash), future in zip(to_parse, futures)]
+
+        # Дубли по содержимому: одна выборка по всем хешам пакета плюс повторы внутри пакета
+        hashes = [result['summary']['content_hash'] for _, _, result in results if not result['error']]
+        existing_hashes = set()
+        if hashes:
+            existing_hashes = {content_hash for (content_hash,) in db.session.query(Track.content_hash).filter(Track.content_hash.in_(hashes))}
+
+        parsed = []
+        for name, file_hash, result in results:
+            if result['error']:
+                report.append({'filename': name, 'status': 'error', 'error': result['error']})
+                continue
+
+            content_hash = result['summary']['content_hash']
+            if content_hash in existing_hashes:
+                report.append({'filename': name, 'status': 'skipped', 'error': 'Такі трэк ўжо быў запампаваны! Выберыце іншы!.'})
+                continue
+            existing_hashes.add(content_hash)
+            parsed.append((name, file_hash, result))
+
+        new_tracks = [
+            new_track_from_summary(name, user_id, result['summary'], file_hash)
+            for name, file_hash, result in parsed
+        ]
+        if new_tracks:
+            try:
+                db.session.add_all(new_tracks)
+                db.session.commit()
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                logging.error(f"Ошибка при сохранении пакета треков пользователя {user_id}: {e}")
+                for name, _, _ in parsed:
+                    report.append({'filename': name, 'status': 'error', 'error': 'Ошибка при работе с базой данных.'})
+                return {'error': 'Ошибка при работе с базой данных.', 'files': report, 'inserted': 0}, 500
+            invalidate_daily_distances([user_id])
+
+        for track, (name, _, result) in zip(new_tracks, parsed):
+            try:
+                save_track_points(track.id, result['lats'], result['lons'], result['eles'], result['times'])
+            except OSError as e:
+                logging.error(f'Не удалось сохранить точки трека {track.id}: {e}')
+
+            report.append({
+                'filename': name,
+                'status': 'ok',
+                'track_id': track.id,
+                'total_distance': track.distance,
+                'duration': track.duration,
+                'net_duration': track.net_duration,
+                'height': track.height
+            })
+
+        return {
+            'success': f'Запампавана трэкаў: {len(new_tracks)}',
+            'files': report,
+            'inserted': len(new_tracks)
+        }, 200
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,149 @@
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+import threading
+import time
+import uuid
+
+import click
+from sqlalchemy.engine import make_url
+from werkzeug.serving import make_server
+
+from kod import app, db
+from kod.models import User, Strava, Track
+from kod.fake_strava import create_fake_strava
+from kod.strava import get_activities, ingest_activities, token_manager
+from kod.strava_ratelimit import BATCH
+from kod.sync_tracks import sync_all_users
+
+
+
+def _same_database(first, second):
+    """Указывают ли два URI SQLAlchemy на одну и ту же базу (сервер, порт и имя базы)."""
+    first, second = make_url(first), make_url(second)
+    return (first.host, first.port, first.database) == (second.host, second.port, second.database)
+
+
+def check_benchmark_database():
+    """Бенчмарк создаёт и удаляет пользователей и треки, поэтому работает только на отдельной базе."""
+    benchmark_uri = app.config['BENCHMARK_DATABASE_URI']
+    if not benchmark_uri:
+        raise click.ClickException('Не задана отдельная база бенчмарка (KOD_BENCHMARK_DATABASE_URI).')
+    if _same_database(benchmark_uri, app.config['PRODUCTION_DATABASE_URI']):
+        raise click.ClickException('KOD_BENCHMARK_DATABASE_URI указывает на рабочую базу.')
+    if not _same_database(benchmark_uri, app.config['SQLALCHEMY_DATABASE_URI']):
+        raise click.ClickException(
+            'Приложение подключено не к базе бенчмарка: запускайте с KOD_DATABASE_URI=$KOD_BENCHMARK_DATABASE_URI.'
+        )
+
+
+def _serve_fake_strava(athletes, activities, latency, rate_429):
+    """Запускает фейковую Strava в фоновом потоке на адресе из STRAVA_API_BASE_URL."""
+    address = urlparse(app.config['STRAVA_API_BASE_URL'])
+    fake = create_fake_strava(athletes, activities, latency, rate_429, short_limit=10 ** 6, daily_limit=10 ** 7)
+    server = make_server(address.hostname, address.port, fake, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def create_synthetic_users(count):
+    """
+    Создаёт count пользователей со связанной фейковой Strava (спортсмены 1..count) и возвращает их id.
+    Логины содержат случайный id прогона, поэтому не совпадают с существующими.
+    """
+    run_id = uuid.uuid4().hex
+    users = [User(login=f'bench:{run_id}:{index}', password='-') for index in range(1, count + 1)]
+    db.session.add_all(users)
+    db.session.flush()
+
+    expires_at = datetime.utcnow() + timedelta(hours=6)
+    db.session.add_all([
+        Strava(
+            user_id=user.id,
+            access_token=f'fake-{index}',
+            refresh_token=f'refresh-{index}',
+            token_expires_at=expires_at,
+            strava_url=f'https://www.strava.com/athletes/{index}'
+        )
+        for index, user in enumerate(users, start=1)
+    ])
+    db.session.commit()
+    return [user.id for user in users]
+
+
+def delete_synthetic_users(user_ids):
+    """Удаляет созданных бенчмарком пользователей (по их id) вместе с треками и данными Strava."""
+    if user_ids:
+        Track.query.filter(Track.user_id.in_(user_ids)).delete(synchronize_session=False)
+        Strava.query.filter(Strava.user_id.in_(user_ids)).delete(synchronize_session=False)
+        User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+        db.session.commit()
+    for user_id in user_ids:
+        token_manager.invalidate(user_id)
+
+
+def run_benchmark(count):
+    """Один прогон: полная синхронизация и отдельно стоимость записи в базу для count пользователей."""
+    user_ids = create_synthetic_users(count)
+    try:
+        started = time.perf_counter()
+        results = sync_all_users(user_ids=user_ids)
+        sync_seconds = time.perf_counter() - started
+        inserted = sum(result['new_tracks'] for result in results)
+        errors = sum(1 for result in results if result['status'] == 'error')
+
+        # Стоимость записи отдельно от сети: заранее забираем активности и заново пишем их в пустую таблицу
+        histories = {
+            user_id: get_activities(f'fake-{index}', BATCH)
+            for index, user_id in enumerate(user_ids, start=1)
+        }
+        Track.query.filter(Track.user_id.in_(user_ids)).delete(synchronize_session=False)
+        db.session.commit()
+
+        started = time.perf_counter()
+        written = sum(ingest_activities(user_id, activities)['inserted'] for user_id, activities in histories.items())
+        write_seconds = time.perf_counter() - started
+    finally:
+        delete_synthetic_users(user_ids)
+
+    return {
+        'users': count,
+        'inserted': inserted,
+        'errors': errors,
+        'sync_seconds': sync_seconds,
+        'written': written,
+        'write_seconds': write_seconds
+    }
+
+
+@app.cli.command('strava-benchmark')
+@click.option('--users', default='10,100,1000', help='Количество пользователей в прогонах, через запятую')
+@click.option('--activities', default=60, help='Активностей у каждого спортсмена')
+@click.option('--latency', default=0.05, help='Средняя задержка ответа фейковой Strava, секунды')
+@click.option('--rate-429', default=0.0, help='Вероятность случайного ответа 429')
+@click.option('--serve/--no-serve', default=True, help='Запустить фейковую Strava в этом процессе')
+def strava_benchmark(users, activities, latency, rate_429, serve):
+    """
+    Нагрузочный тест синхронизации на фейковой Strava: пропускная способность sync_all_users
+    и стоимость записи треков в базу. Работает только на отдельной базе:
+    KOD_BENCHMARK_DATABASE_URI=<база> KOD_DATABASE_URI=<база> KOD_SCHEDULER=off
+    STRAVA_API_BASE_URL=http://127.0.0.1:5055 flask --app kod strava-benchmark
+    """
+    if 'strava.com' in app.config['STRAVA_API_BASE_URL']:
+        raise click.ClickException('STRAVA_API_BASE_URL указывает на настоящую Strava.')
+    check_benchmark_database()
+
+    counts = [int(value) for value in users.split(',')]
+    server = _serve_fake_strava(max(counts), activities, latency, rate_429) if serve else None
+
+    click.echo(f"{'users':>6} {'tracks':>8} {'errors':>6} {'sync, s':>9} {'users/s':>8} {'write, s':>9} {'rows/s':>9}")
+    try:
+        for count in counts:
+            result = run_benchmark(count)
+            click.echo(
+                f"{result['users']:>6} {result['inserted']:>8} {result['errors']:>6} "
+                f"{result['sync_seconds']:>9.2f} {result['users'] / result['sync_seconds']:>8.1f} "
+                f"{result['write_seconds']:>9.2f} {result['written'] / max(result['write_seconds'], 1e-9):>9.0f}"
+            )
+    finally:
+        if server:
+            server.shutdown()
@@ -0,0 +1,95 @@
+from collections import OrderedDict
+from flask import session
+from flask_login import current_user
+import threading
+import time
+import uuid
+
+from kod import app
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Потокобезопасный кэш в памяти процесса: записи живут ttl секунд,
+    а при переполнении вытесняются давно не использованные (LRU).
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        """Удаляет все записи с ключами-кортежами, начинающимися с prefix."""
+        with self._lock:
+            for key in [key for key in self._data if key[:len(prefix)] == prefix]:
+                del self._data[key]
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Серверное хранилище данных сессии: в cookie лежит только ключ
+session_store = TTLCache(app.config['SESSION_CACHE_MAXSIZE'], app.config['SESSION_CACHE_TTL'])
+
+
+def _session_key(create=False):
+    """
+    Ключ серверной сессии: ключ из cookie вместе с id пользователя, чтобы после смены
+    пользователя в том же браузере данные прежнего не были видны.
+    """
+    key = session.get('store_key')
+    if key is None and create:
+        key = session['store_key'] = uuid.uuid4().hex
+    if key is None:
+        return None
+    return key, current_user.get_id()
+
+
+def get_session_data(name, default=None):
+    """Значение name из серверной сессии текущего пользователя."""
+    key = _session_key()
+    if key is None:
+        return default
+    return session_store.get(key + (name,), default)
+
+
+def set_session_data(name, value):
+    """Сохраняет value в серверной сессии; в cookie попадает только ключ сессии."""
+    session_store.set(_session_key(create=True) + (name,), value)
+
+
+def clear_session_data():
+    """
+    Удаляет данные серверной сессии в этом процессе и ключ из cookie; вызывается при входе и выходе.
+    Записи в других процессах недоступны по новому ключу и истекают по SESSION_CACHE_TTL.
+    """
+    key = session.pop('store_key', None)
+    if key is not None:
+        session_store.delete_prefix((key,))
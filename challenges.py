@@ -1,17 +1,21 @@
 from flask import render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
-from itertools import groupby
-from operator import itemgetter
 import bleach
+from sqlalchemy import func, case, and_, or_
+from sqlalchemy.orm import joinedload
 
 
 
 from kod import app, db
 from kod.models import Challenge, ChallengeParticipants, User, Track, UserPosition, Comment
-from kod.positions import update_user_positions
+from kod.positions import update_user_positions, get_position_changes
 
 from kod.create_challenges import create_challenge
+from kod.cache import TTLCache
+
+# Дистанции по дням для графиков челенджей: challenge_id -> [(дата, дистанция)]
+daily_distances_cache = TTLCache(app.config['DAILY_DISTANCES_CACHE_MAXSIZE'], app.config['DAILY_DISTANCES_CACHE_TTL'])
 
 @app.route('/challenges', methods=['GET', 'POST'])
 def challenges():
@@ -76,7 +80,9 @@ def challenge_detail(challenge_id):
     }.get(challenge.type, challenge.type)
 
     creator = User.query.get(challenge.creator_id)
-    participants = ChallengeParticipants.query.filter_by(challenge_id=challenge_id).all()
+    participants = ChallengeParticipants.query.options(
+        joinedload(ChallengeParticipants.user)
+    ).filter_by(challenge_id=challenge_id).all()
     start_date = challenge.start_date
     end_date = challenge.end_date
     today = datetime.today().date()
@@ -88,15 +94,14 @@ def challenge_detail(challenge_id):
     participants_data = []
     participants_no_distance = 0  # Количество участников, не проехавших ни километра
 
+    # Дистанции и изменения позиций всех участников одним запросом каждое
+    standings = get_challenge_standings(challenge, today)
+    position_changes = get_position_changes(challenge_id, today)
+
     # Обработка данных участников
     for participant in participants:
-        filtered_tracks = Track.query.filter_by(user_id=participant.user_id).filter(
-            Track.record_time >= start_date,
-            Track.record_time <= end_date + timedelta(days=1),
-            (Track.type == 'ride') | (Track.type == 'virtualride') | (Track.type.is_(None))
-        ).all()
-
-        participant_distance = sum(track.distance for track in filtered_tracks)
+        standing = standings.get(participant.user_id)
+        participant_distance = standing.total_distance if standing else 0
         total_distance_covered += participant_distance
 
         if participant_distance == 0:
@@ -105,32 +110,12 @@ def challenge_detail(challenge_id):
         contribution_percentage = (participant_distance / challenge.distance * 100) if challenge.distance > 0 else 0
         participant_contributions[participant.user_id] = round(contribution_percentage, 2)
 
-        daily_tracks = [track for track in filtered_tracks if track.upload_time.date() == today]
-        daily_distance = sum(track.distance for track in daily_tracks)
-        daily_distance_covered += daily_distance
-
-        last_position_today = (
-            UserPosition.query.filter_by(user_id=participant.user_id, challenge_id=challenge_id)
-            .filter(UserPosition.date_position >= datetime.combine(today, datetime.min.time()))
-            .filter(UserPosition.date_position <= datetime.combine(today, datetime.max.time()))
-            .order_by(UserPosition.date_position.desc())
-            .first()
-        )
-
-        last_position_before_today = (
-            UserPosition.query.filter_by(user_id=participant.user_id, challenge_id=challenge_id)
-            .filter(UserPosition.date_position < datetime.combine(today, datetime.min.time()))
-            .order_by(UserPosition.date_position.desc())
-            .first()
-        )
+        daily_distance_covered += standing.daily_distance if standing else 0
 
-        position_change = 0
+        position_change = position_changes.get(participant.user_id, 0)
         arrow = None
         position_change_text = None
 
-        if last_position_today and last_position_before_today:
-            position_change = last_position_today.position - last_position_before_today.position
-
         if position_change > 0:
             arrow = "down-arrow"
         elif position_change < 0:
@@ -155,18 +140,7 @@ def challenge_detail(challenge_id):
     daily_percentage = (daily_distance_covered / challenge.distance * 100) if challenge.distance > 0 else 0
     daily_percentage = min(daily_percentage, 100)
 
-    daily_total_distances = {}
-    tracks = Track.query.filter(
-        Track.record_time >= start_date,
-        Track.record_time <= end_date + timedelta(days=1),
-        (Track.type == 'ride') | (Track.type == 'virtualride') | (Track.type.is_(None))
-    )
-    if challenge.type == 'individual':
-        tracks = tracks.filter_by(user_id=creator.id)
-
-    for track in tracks.all():
-        record_date = track.record_time.date()
-        daily_total_distances[record_date] = daily_total_distances.get(record_date, 0) + track.distance
+    daily_total_distances = dict(get_challenge_daily_distances(challenge))
 
     # Получаем треки для создателя (или всех участников в случае группового челенджа)
     tracks_info = get_tracks_for_challenge(challenge_id, user_id=creator.id)
@@ -233,6 +207,7 @@ def join_challenge(challenge_id):
         participant = ChallengeParticipants(challenge_id=challenge_id, user_id=current_user.id, track_id=track_id)
         db.session.add(participant)
         db.session.commit()
+        daily_distances_cache.delete(challenge_id)
     
     update_user_positions(challenge_id)
 
@@ -248,6 +223,7 @@ def leave_challenge(challenge_id):
     if existing_participant:
         db.session.delete(existing_participant)
         db.session.commit()
+        daily_distances_cache.delete(challenge_id)
         flash('Вы успешно вышли из челенджа.', 'info')  # Уведомление
     
     update_user_positions(challenge_id)
@@ -300,35 +276,88 @@ def delete_challenge_user(challenge_id):
     return redirect(url_for('archive'))
 
 
-def calculate_daily_distances(participants, start_date, end_date):
-    # Словарь для хранения общего расстояния по дням
-    daily_total_distances = {}
+def get_challenge_standings(challenge, today):
+    """
+    Итоги участников челенджа одним запросом: challenge_participants LEFT JOIN gpx за период челенджа
+    с GROUP BY user_id. Возвращает {user_id: строка(user_id, total_distance, daily_distance)},
+    где daily_distance — дистанция треков, загруженных сегодня.
+    """
+    track_window = and_(
+        Track.user_id == ChallengeParticipants.user_id,
+        Track.record_time >= challenge.start_date,
+        Track.record_time <= challenge.end_date + timedelta(days=1),
+        or_(Track.type == 'ride', Track.type == 'virtualride', Track.type.is_(None))
+    )
 
-    for participant in participants:
-        # Фильтруем треки по user_id вместо username
-        tracks = Track.query.filter_by(user_id=participant.user.id).all()
+    rows = db.session.query(
+        ChallengeParticipants.user_id,
+        func.coalesce(func.sum(Track.distance), 0).label('total_distance'),
+        func.coalesce(func.sum(case((func.date(Track.upload_time) == today, Track.distance), else_=0)), 0).label('daily_distance')
+    ).outerjoin(Track, track_window).filter(
+        ChallengeParticipants.challenge_id == challenge.id
+    ).group_by(ChallengeParticipants.user_id).all()
+
+    return {row.user_id: row for row in rows}
+
+
+def query_daily_distances(user_ids, start_date, end_date):
+    """
+    Дистанция по дням, посчитанная в базе (GROUP BY DATE(record_time)), для треков пользователей
+    user_ids (список или подзапрос) за период челенджа. Возвращает [(дата, дистанция)] от старой к новой.
+    """
+    day = func.date(Track.record_time)
+    rows = db.session.query(day.label('day'), func.sum(Track.distance)).filter(
+        Track.user_id.in_(user_ids),
+        Track.record_time >= start_date,
+        Track.record_time <= end_date + timedelta(days=1),
+        or_(Track.type == 'ride', Track.type == 'virtualride', Track.type.is_(None))
+    ).group_by(day).order_by(day).all()
 
-        # Фильтруем треки по дате
-        filtered_tracks = [
-            track for track in tracks
-            if start_date <= track.record_time.date() <= end_date + timedelta(days=1) # Используем record_time для фильтрации
-        ]
+    return [(record_date, distance or 0) for record_date, distance in rows]
 
-        # Группируем треки по дням
-        grouped_tracks = groupby(sorted(filtered_tracks, key=lambda x: x.record_time.date()), key=lambda x: x.record_time.date())
 
-        # Суммируем дистанцию для каждого дня
-        for date, group in grouped_tracks:
-            day_distance = sum(track.distance for track in group)
-            if date in daily_total_distances:
-                daily_total_distances[date] += day_distance
-            else:
-                daily_total_distances[date] = day_distance
+def get_challenge_daily_distances(challenge):
+    """
+    Дистанция по дням для графика челенджа: треки создателя для личной цели, треки участников — для талакі.
+    Результат кэшируется на DAILY_DISTANCES_CACHE_TTL секунд.
+    """
+    daily_distances = daily_distances_cache.get(challenge.id)
+    if daily_distances is None:
+        if challenge.type == 'individual':
+            user_ids = [challenge.creator_id]
+        else:
+            user_ids = db.session.query(ChallengeParticipants.user_id).filter(
+                ChallengeParticipants.challenge_id == challenge.id
+            ).scalar_subquery()
+        daily_distances = query_daily_distances(user_ids, challenge.start_date, challenge.end_date)
+        daily_distances_cache.set(challenge.id, daily_distances)
+    return daily_distances
+
+
+def invalidate_daily_distances(user_ids):
+    """
+    Сбрасывает кэш дистанций по дням для челенджей, где пользователи из user_ids участвуют или
+    которые они создали. Вызывается после добавления, изменения или удаления их треков.
+    """
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return
+    challenge_ids = {challenge_id for (challenge_id,) in db.session.query(ChallengeParticipants.challenge_id).filter(
+        ChallengeParticipants.user_id.in_(user_ids)
+    )}
+    challenge_ids.update(challenge_id for (challenge_id,) in db.session.query(Challenge.id).filter(
+        Challenge.creator_id.in_(user_ids)
+    ))
+    for challenge_id in challenge_ids:
+        daily_distances_cache.delete(challenge_id)
 
-    # Сортируем по дате (от старой к новой)
-    sorted_daily_distances = sorted(daily_total_distances.items(), key=itemgetter(0))
 
-    return sorted_daily_distances
+def calculate_daily_distances(participants, start_date, end_date):
+    """Дистанция по дням для участников, от старой даты к новой."""
+    user_ids = list({participant.user_id for participant in participants})
+    if not user_ids:
+        return []
+    return query_daily_distances(user_ids, start_date, end_date)
 
 
 def get_tracks_for_challenge(challenge_id, user_id):
@@ -0,0 +1,70 @@
+from flask import request
+from werkzeug.wsgi import LimitedStream
+import gzip
+import zlib
+
+from kod import app
+
+try:
+    import zstandard
+except ImportError:  # zstd необязателен: без пакета zstandard .gpx.zst просто не принимаются
+    zstandard = None
+
+# Поддерживаемые сжатые варианты GPX: расширение -> алгоритм
+COMPRESSED_EXTENSIONS = {'.gpx.gz': 'gzip'}
+if zstandard is not None:
+    COMPRESSED_EXTENSIONS['.gpx.zst'] = 'zstd'
+
+# Ошибки распаковки повреждённого или обрезанного архива: это ошибка клиента, как и битый XML
+DECOMPRESSION_ERRORS = (gzip.BadGzipFile, zlib.error, EOFError)
+if zstandard is not None:
+    DECOMPRESSION_ERRORS += (zstandard.ZstdError,)
+
+# Эндпоинты загрузки, для которых тело запроса может прийти с Content-Encoding: gzip
+GZIP_BODY_ENDPOINTS = ('upload_file', 'upload_batch')
+
+
+def detect_compression(filename):
+    """Алгоритм сжатия по имени файла или None для обычного .gpx."""
+    lower_name = filename.lower()
+    for extension, compression in COMPRESSED_EXTENSIONS.items():
+        if lower_name.endswith(extension):
+            return compression
+    return None
+
+
+def strip_compression_suffix(filename):
+    """Имя файла без суффикса сжатия: ride.gpx.gz -> ride.gpx."""
+    if detect_compression(filename):
+        return filename.rsplit('.', 1)[0]
+    return filename
+
+
+def open_gpx(path, compression=None):
+    """Открывает GPX на чтение; сжатый файл распаковывается потоково, по мере чтения парсером."""
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)
+    return open(path, 'rb')
+
+
+@app.before_request
+def decompress_upload_body():
+    """Потоково распаковывает тело загрузки, отправленное с Content-Encoding: gzip."""
+    if request.endpoint not in GZIP_BODY_ENDPOINTS:
+        return None
+    if request.headers.get('Content-Encoding', '').lower() != 'gzip':
+        return None
+
+    environ = request.environ
+    body = environ['wsgi.input']
+    # Ограничиваем сырой поток длиной тела: иначе на keep-alive соединении GzipFile ждёт следующих байтов
+    content_length = environ.get('CONTENT_LENGTH')
+    if content_length:
+        body = LimitedStream(body, int(content_length))
+    environ['wsgi.input'] = gzip.GzipFile(fileobj=body, mode='rb')
+    # Длина распакованного тела неизвестна: читаем поток до конца
+    environ.pop('CONTENT_LENGTH', None)
+    environ['wsgi.input_terminated'] = True
+    return None
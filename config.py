@@ -1,6 +1,13 @@
+import os
+
+
 class Configuration(object):
     DEBUG = True
-    SQLALCHEMY_DATABASE_URI = 'mysql+mysqlconnector://root:@localhost/Ab_spab?charset=utf8mb4'
+    # Рабочая база; KOD_DATABASE_URI подменяет её, например на отдельную базу нагрузочного теста
+    PRODUCTION_DATABASE_URI = 'mysql+mysqlconnector://root:@localhost/Ab_spab?charset=utf8mb4'
+    SQLALCHEMY_DATABASE_URI = os.getenv('KOD_DATABASE_URI', PRODUCTION_DATABASE_URI)
+    # Отдельная база для команды strava-benchmark; без неё (или если это рабочая база) команда не запускается
+    BENCHMARK_DATABASE_URI = os.getenv('KOD_BENCHMARK_DATABASE_URI')
 
     SQLALCHEMY_ENGINE_OPTIONS = {
         'pool_pre_ping': True,     # Проверка соединения перед использованием
@@ -16,4 +23,78 @@ class Configuration(object):
         'challenge': 'mysql+mysqlconnector://root:@localhost/Ab_spab',
         'challenge_participants': 'mysql+mysqlconnector://root:@localhost/Ab_spab',
     }
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Метод расчёта дистанции трека: 'ellipsoid' (точный, WGS-84) или 'haversine' (быстрый)
+    TRACK_DISTANCE_METHOD = 'ellipsoid'
+
+    # Фоновая обработка: размер пула и сколько секунд хранить результат завершённой задачи
+    BACKGROUND_WORKERS = 4
+    BACKGROUND_JOB_TTL = 3600
+
+    # Папка для временных файлов загрузок (None — системная временная папка)
+    UPLOAD_TMP_FOLDER = None
+
+    # Папка с сохранёнными точками треков (по файлу .npy на каждый Track.id)
+    TRACK_POINTS_FOLDER = 'track_points'
+
+    # Допуск упрощения линии трека в ответе на загрузку, в метрах
+    POLYLINE_TOLERANCE = 10.0
+
+    # Количество процессов для параллельного разбора файлов при пакетной загрузке
+    BATCH_PARSE_WORKERS = 4
+    # Предел суммарного размера распакованных файлов из ZIP-архивов одной пакетной загрузки, в байтах
+    BATCH_MAX_UNCOMPRESSED_SIZE = 512 * 1024 * 1024
+
+    # Сколько пользователей Strava синхронизируется одновременно
+    STRAVA_SYNC_WORKERS = 8
+
+    # Квота API Strava (15 минут / сутки); уточняется по заголовкам ответов
+    STRAVA_RATE_LIMIT_SHORT = 200
+    STRAVA_RATE_LIMIT_DAILY = 2000
+    # Сколько запросов окна оставлять интерактивным запросам и сколько секунд они готовы ждать квоту
+    STRAVA_INTERACTIVE_RESERVE = 20
+    STRAVA_INTERACTIVE_MAX_WAIT = 10
+
+    # Адрес API Strava (для нагрузочных тестов — локальная замена из fake_strava.py)
+    STRAVA_API_BASE_URL = os.getenv('STRAVA_API_BASE_URL', 'https://www.strava.com')
+
+    # Клиент API Strava: таймауты (секунды), повторы на 5xx/429 с базовой задержкой и размер пула соединений
+    STRAVA_API_TIMEOUT = 10.0
+    STRAVA_API_CONNECT_TIMEOUT = 5.0
+    STRAVA_API_MAX_RETRIES = 3
+    STRAVA_API_BACKOFF = 0.5
+    STRAVA_API_POOL_SIZE = 20
+
+    # За сколько секунд до истечения токена Strava обновлять его заранее
+    STRAVA_TOKEN_REFRESH_MARGIN = 300
+
+    # Запас (в часах) при инкрементальной синхронизации от времени прошлой синхронизации
+    STRAVA_SYNC_OVERLAP_HOURS = 48
+
+    # Через сколько минут после прошлой синхронизации страница профиля запускает новую (в фоне)
+    STRAVA_PROFILE_STALENESS_MINUTES = 30
+
+    # Серверное хранилище данных сессии (профиль и активности Strava): время жизни в секундах и число записей
+    SESSION_CACHE_TTL = 1800
+    SESSION_CACHE_MAXSIZE = 2000
+
+    # Кэш дистанций по дням для графиков челенджей. Он в памяти процесса: сбрасывается при изменении
+    # треков участников в этом процессе, а в остальных воркерах gunicorn график может отставать до TTL секунд
+    DAILY_DISTANCES_CACHE_TTL = 300
+    DAILY_DISTANCES_CACHE_MAXSIZE = 500
+
+    # Подписка на события Strava (/strava/webhook): секретный токен проверки при создании подписки и её id.
+    # Пока они не заданы в окружении, подписка не подтверждается, а события отклоняются
+    STRAVA_WEBHOOK_VERIFY_TOKEN = os.getenv('STRAVA_WEBHOOK_VERIFY_TOKEN')
+    STRAVA_WEBHOOK_SUBSCRIPTION_ID = int(os.getenv('STRAVA_WEBHOOK_SUBSCRIPTION_ID', 0)) or None
+
+    # Встроенный планировщик синхронизации Strava. Основной канал — события подписки,
+    # поэтому опрос редкий: страховка на случай пропущенных событий
+    SCHEDULER_ENABLED = os.getenv('KOD_SCHEDULER', 'on') == 'on'
+    SCHEDULER_WORKERS = 2
+    # Как часто (в секундах) воркеры без планировщика пробуют взять его блокировку
+    SCHEDULER_LOCK_RETRY_SECONDS = 300
+    STRAVA_POLL_INTERVAL_MINUTES = 360
+    # Случайный сдвиг каждого запуска (секунды), чтобы пользователи не синхронизировались одновременно
+    STRAVA_POLL_JITTER_SECONDS = 600
@@ -0,0 +1,109 @@
+import numpy as np
+from geographiclib.geodesic import Geodesic
+
+# Эллипсоид WGS-84 (тот же, что по умолчанию использует geopy.distance.geodesic)
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+# Средний радиус Земли в километрах (как в geopy.distance.EARTH_RADIUS)
+EARTH_RADIUS_KM = 6371.009
+
+VINCENTY_TOLERANCE = 1e-12
+VINCENTY_MAX_ITERATIONS = 20
+
+
+def haversine_segments(lats, lons):
+    """Быстрый режим: длины отрезков между соседними точками по сфере, в километрах."""
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lon = np.radians(np.asarray(lons, dtype=np.float64))
+    if lat.size < 2:
+        return np.zeros(0)
+
+    dlat = np.diff(lat)
+    dlon = np.diff(lon)
+    h = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def ellipsoid_segments(lats, lons):
+    """
+    Точный режим: длины отрезков на эллипсоиде WGS-84, в километрах.
+    Все отрезки решаются одним векторным проходом (обратная задача Винсенти);
+    редкие почти антиподальные пары, где метод не сходится, досчитываются через geographiclib.
+    """
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lon = np.radians(np.asarray(lons, dtype=np.float64))
+    if lat.size < 2:
+        return np.zeros(0)
+
+    f = WGS84_F
+    L = np.diff(lon)
+    U = np.arctan((1 - f) * np.tan(lat))
+    sin_u1, cos_u1 = np.sin(U[:-1]), np.cos(U[:-1])
+    sin_u2, cos_u2 = np.sin(U[1:]), np.cos(U[1:])
+
+    lam = L.copy()
+    converged = np.zeros(L.shape, dtype=bool)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(VINCENTY_MAX_ITERATIONS):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+
+            C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            lam_prev = lam
+            lam = L + (1 - C) * f * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2))
+            )
+
+            converged = np.abs(lam - lam_prev) < VINCENTY_TOLERANCE
+            if converged.all():
+                break
+
+        u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (
+            cos_2sigma_m + B / 4 * (
+                cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+                - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+            )
+        )
+        meters = WGS84_B * A * (sigma - delta_sigma)
+
+    meters = np.where(sin_sigma == 0, 0.0, meters)
+
+    # Досчитываем пары, для которых итерации не сошлись (почти антиподальные точки)
+    lats_deg = np.asarray(lats, dtype=np.float64)
+    lons_deg = np.asarray(lons, dtype=np.float64)
+    for i in np.flatnonzero(~converged | ~np.isfinite(meters)):
+        meters[i] = Geodesic.WGS84.Inverse(lats_deg[i], lons_deg[i], lats_deg[i + 1], lons_deg[i + 1])['s12']
+
+    return meters / 1000.0
+
+
+SEGMENT_METHODS = {
+    'ellipsoid': ellipsoid_segments,
+    'haversine': haversine_segments,
+}
+
+
+def segment_distances(lats, lons, method='ellipsoid'):
+    """Длины всех отрезков трека (км) за один пакетный проход."""
+    try:
+        segments = SEGMENT_METHODS[method]
+    except KeyError:
+        raise ValueError(f"Неизвестный метод расчёта расстояния: {method}")
+    return segments(lats, lons)
+
+
+def track_distance(lats, lons, method='ellipsoid'):
+    """Общая длина трека в километрах."""
+    return float(segment_distances(lats, lons, method).sum())
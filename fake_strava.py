@@ -0,0 +1,194 @@
+"""
+Локальная замена API Strava для нагрузочных тестов и отладки синхронизации без внешней сети.
+
+Отдельное Flask-приложение: профиль спортсмена, список активностей с пагинацией и after,
+одна активность, обмен и обновление токенов OAuth. Отвечает заголовками X-RateLimit-*,
+возвращает 429 при исчерпании квоты (или случайно, с заданной вероятностью) и может добавлять задержку.
+
+Токен доступа спортсмена N — строка fake-N. Модуль не зависит от приложения; запуск:
+    python fake_strava.py --port 5055 --athletes 1000 --activities 120 --latency 0.05
+и STRAVA_API_BASE_URL=http://127.0.0.1:5055 для приложения.
+"""
+from flask import Flask, request, jsonify
+from datetime import datetime, timedelta
+import threading
+import argparse
+import random
+import time
+
+ACTIVITY_TYPES = ('Ride', 'Ride', 'Ride', 'VirtualRide', 'Run')
+
+
+def make_activities(athlete_id, count, seed=0, days=60):
+    """Детерминированная история активностей спортсмена за последние days дней (от старых к новым)."""
+    rng = random.Random(seed * 1000003 + athlete_id)
+    now = datetime.utcnow().replace(microsecond=0)
+    activities = []
+    for index in range(count):
+        start = now - timedelta(days=days) + timedelta(seconds=rng.uniform(0, days * 86400))
+        moving_time = rng.randint(900, 5 * 3600)
+        activities.append({
+            'id': athlete_id * 100000 + index,
+            'name': f'Fake ride {athlete_id}-{index}',
+            'type': rng.choice(ACTIVITY_TYPES),
+            'distance': round(moving_time * rng.uniform(4.0, 9.0), 1),
+            'moving_time': moving_time,
+            'elapsed_time': moving_time + rng.randint(0, 1800),
+            'total_elevation_gain': round(rng.uniform(0, 1200), 1),
+            'start_date': start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'athlete': {'id': athlete_id}
+        })
+    activities.sort(key=lambda activity: activity['start_date'])
+    return activities
+
+
+class FakeQuota:
+    """Счётчики квоты как у Strava: 15-минутное окно и сутки."""
+
+    def __init__(self, short_limit, daily_limit):
+        self.short_limit = short_limit
+        self.daily_limit = daily_limit
+        self.short_usage = 0
+        self.daily_usage = 0
+        self._window = None
+        self._day = None
+        self._lock = threading.Lock()
+
+    def hit(self):
+        """Учитывает запрос; возвращает False, если квота исчерпана."""
+        now = datetime.utcnow()
+        window = (now.date(), now.hour, now.minute // 15)
+        with self._lock:
+            if window != self._window:
+                self._window, self.short_usage = window, 0
+            if now.date() != self._day:
+                self._day, self.daily_usage = now.date(), 0
+            self.short_usage += 1
+            self.daily_usage += 1
+            return self.short_usage <= self.short_limit and self.daily_usage <= self.daily_limit
+
+    def headers(self):
+        return {
+            'X-RateLimit-Limit': f'{self.short_limit},{self.daily_limit}',
+            'X-RateLimit-Usage': f'{self.short_usage},{self.daily_usage}'
+        }
+
+
+def create_fake_strava(athletes=10, activities=60, latency=0.0, rate_429=0.0,
+                       short_limit=200, daily_limit=2000, seed=0):
+    """
+    Создаёт приложение фейковой Strava.
+    :param athletes: количество спортсменов (id от 1 до athletes)
+    :param activities: число активностей у каждого спортсмена
+    :param latency: средняя задержка ответа в секундах
+    :param rate_429: вероятность ответить 429 без исчерпания квоты
+    """
+    fake = Flask(__name__)
+    quota = FakeQuota(short_limit, daily_limit)
+    histories = {}
+    histories_lock = threading.Lock()
+    rng = random.Random(seed)
+
+    def history(athlete_id):
+        with histories_lock:
+            if athlete_id not in histories:
+                histories[athlete_id] = make_activities(athlete_id, activities, seed)
+            return histories[athlete_id]
+
+    def current_athlete():
+        token = request.headers.get('Authorization', '').replace('Bearer ', '')
+        if not token.startswith('fake-'):
+            return None
+        try:
+            athlete_id = int(token[len('fake-'):])
+        except ValueError:
+            return None
+        return athlete_id if 1 <= athlete_id <= athletes else None
+
+    def respond(payload, status=200):
+        response = jsonify(payload)
+        response.status_code = status
+        response.headers.update(quota.headers())
+        return response
+
+    @fake.before_request
+    def throttle():
+        if latency:
+            time.sleep(rng.uniform(0.5, 1.5) * latency)
+        if request.path.startswith('/oauth/'):
+            return None  # OAuth не расходует квоту API
+        if not quota.hit() or rng.random() < rate_429:
+            return respond({'message': 'Rate Limit Exceeded'}, 429)
+        if current_athlete() is None:
+            return respond({'message': 'Authorization Error'}, 401)
+        return None
+
+    @fake.route('/api/v3/athlete')
+    def athlete():
+        athlete_id = current_athlete()
+        return respond({'id': athlete_id, 'firstname': 'Fake', 'lastname': f'Athlete {athlete_id}'})
+
+    @fake.route('/api/v3/athlete/activities')
+    def athlete_activities():
+        page = request.args.get('page', 1, type=int)
+        per_page = min(request.args.get('per_page', 30, type=int), 200)
+        after = request.args.get('after', type=int)
+
+        items = history(current_athlete())
+        if after is not None:
+            after_date = datetime.utcfromtimestamp(after).strftime('%Y-%m-%dT%H:%M:%SZ')
+            items = [activity for activity in items if activity['start_date'] > after_date]
+        else:
+            items = items[::-1]  # Без after Strava отдаёт от новых к старым
+
+        start = (page - 1) * per_page
+        return respond(items[start:start + per_page])
+
+    @fake.route('/api/v3/activities/<int:activity_id>')
+    def activity(activity_id):
+        athlete_id, index = divmod(activity_id, 100000)
+        if athlete_id != current_athlete() or index >= activities:
+            return respond({'message': 'Record Not Found'}, 404)
+        return respond(next(item for item in history(athlete_id) if item['id'] == activity_id))
+
+    @fake.route('/oauth/token', methods=['POST'])
+    def token():
+        grant_type = request.form.get('grant_type')
+        if grant_type == 'authorization_code':
+            athlete_id = request.form.get('code', type=int)  # Кодом авторизации служит id спортсмена
+        elif grant_type == 'refresh_token':
+            refresh_token = request.form.get('refresh_token', '')
+            suffix = refresh_token[len('refresh-'):]
+            athlete_id = int(suffix) if refresh_token.startswith('refresh-') and suffix.isdigit() else None
+        else:
+            return respond({'message': 'Bad Request'}, 400)
+
+        if not athlete_id or not 1 <= athlete_id <= athletes:
+            return respond({'message': 'Bad Request'}, 400)
+
+        return respond({
+            'token_type': 'Bearer',
+            'access_token': f'fake-{athlete_id}',
+            'refresh_token': f'refresh-{athlete_id}',
+            'expires_at': int(time.time()) + 6 * 3600,
+            'athlete': {'id': athlete_id}
+        })
+
+    return fake
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Локальная замена API Strava')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--athletes', type=int, default=10)
+    parser.add_argument('--activities', type=int, default=60)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--short-limit', type=int, default=200)
+    parser.add_argument('--daily-limit', type=int, default=2000)
+    args = parser.parse_args()
+
+    create_fake_strava(
+        args.athletes, args.activities, args.latency, args.rate_429, args.short_limit, args.daily_limit
+    ).run(args.host, args.port, threaded=True)
@@ -0,0 +1,62 @@
+from lxml import etree
+
+
+def _localname(elem):
+    """Имя тега без пространства имён (GPX 1.0 и 1.1 используют разные namespace)."""
+    return etree.QName(elem).localname
+
+
+def _free(elem):
+    """Освобождает уже обработанный элемент и его предыдущих соседей, чтобы дерево не росло."""
+    elem.clear()
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+
+
+def iter_trackpoints(source):
+    """
+    Потоковый разбор GPX через etree.iterparse.
+    Отдаёт трекпункты по одному в виде словарей (name, lat, lon, ele, time),
+    обработанные элементы сразу очищаются, поэтому расход памяти не зависит от размера файла.
+    :param source: путь к файлу или файлоподобный объект
+    """
+    track_name = None
+    ele = None
+    time = None
+
+    for event, elem in etree.iterparse(source, events=('start', 'end')):
+        tag = _localname(elem)
+
+        if event == 'start':
+            if tag == 'trk':
+                track_name = None
+            elif tag == 'trkpt':
+                ele = None
+                time = None
+            continue
+
+        if tag == 'name':
+            parent = elem.getparent()
+            if parent is not None and _localname(parent) == 'trk':
+                track_name = elem.text
+        elif tag in ('ele', 'time'):
+            parent = elem.getparent()
+            if parent is not None and _localname(parent) == 'trkpt':
+                if tag == 'ele':
+                    ele = elem.text
+                else:
+                    time = elem.text
+        elif tag == 'trkpt':
+            point = {
+                'name': track_name,
+                'lat': elem.get('lat'),
+                'lon': elem.get('lon'),
+                'ele': ele,
+                'time': time
+            }
+            _free(elem)
+            yield point
+        elif tag in ('trkseg', 'trk', 'wpt', 'rte', 'metadata'):
+            _free(elem)
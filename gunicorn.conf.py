@@ -0,0 +1,13 @@
+# Настройки gunicorn: gunicorn -c kod/gunicorn.conf.py kod:app
+
+# Потоковые воркеры: поток SSE прогресса синхронизации и фоновые задачи не блокируют воркер,
+# а арбитр не убивает его по таймауту, пока запросы обслуживаются
+worker_class = 'gthread'
+threads = 8
+timeout = 60
+
+
+def post_fork(server, worker):
+    """Запуск планировщика синхронизации Strava в воркере; работать он будет только в одном (блокировка MySQL)."""
+    from kod.scheduler import start_scheduler
+    start_scheduler()
@@ -33,6 +33,8 @@ class Track(db.Model):
     net_duration = db.Column(db.String)
     type = db.Column(db.String(128), nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True, unique=True, index=True)  # Хеш точек трека для поиска дублей
+    file_hash = db.Column(db.String(64), nullable=True, unique=True, index=True)  # sha256 загруженного файла (как есть)
 
 
 class Challenge(db.Model):
@@ -151,3 +153,21 @@ class Comment(db.Model):
 
     user = db.relationship('User', backref=db.backref('comments', lazy=True))
     challenge = db.relationship('Challenge', backref=db.backref('comments', lazy=True))
+
+
+class BackgroundJob(db.Model):
+    """Фоновая задача (см. kod.background). Хранится в базе, чтобы её статус видели все воркеры."""
+    __tablename__ = 'background_job'
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    owner_id = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(16), nullable=False)  # queued, running, done, failed, cancelled
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True, index=True)
+    result = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    progress = db.Column(db.JSON, nullable=True)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+
+    __table_args__ = (db.Index('ix_background_job_kind_owner', 'kind', 'owner_id', 'created_at'),)
@@ -0,0 +1,81 @@
+import numpy as np
+
+from kod.distance import EARTH_RADIUS_KM
+
+
+def _project(lats, lons):
+    """Переводит координаты в метры на локальной плоскости (достаточно для упрощения линии)."""
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lon = np.radians(np.asarray(lons, dtype=np.float64))
+    radius = EARTH_RADIUS_KM * 1000
+    x = lon * np.cos(lat.mean() if lat.size else 0.0) * radius
+    y = lat * radius
+    return x, y
+
+
+def simplify(lats, lons, tolerance):
+    """
+    Упрощение линии трека алгоритмом Дугласа-Пекера.
+    :param tolerance: допустимое отклонение в метрах
+    :return: индексы оставленных точек (по возрастанию)
+    """
+    n = len(lats)
+    if n <= 2:
+        return np.arange(n)
+
+    x, y = _project(lats, lons)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        # Расстояния от промежуточных точек до отрезка start-end, одним векторным вычислением
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        length_sq = dx * dx + dy * dy
+        if length_sq == 0:
+            distances = np.hypot(px, py)
+        else:
+            t = np.clip((px * dx + py * dy) / length_sq, 0.0, 1.0)
+            distances = np.hypot(px - t * dx, py - t * dy)
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = start + 1 + farthest
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+
+    return np.flatnonzero(keep)
+
+
+def encode_polyline(lats, lons, precision=5):
+    """Кодирует координаты в формат Google Encoded Polyline."""
+    factor = 10 ** precision
+    lat_values = np.round(np.asarray(lats, dtype=np.float64) * factor).astype(np.int64)
+    lon_values = np.round(np.asarray(lons, dtype=np.float64) * factor).astype(np.int64)
+
+    lat_deltas = np.diff(lat_values, prepend=0)
+    lon_deltas = np.diff(lon_values, prepend=0)
+
+    chunks = []
+    for lat_delta, lon_delta in zip(lat_deltas.tolist(), lon_deltas.tolist()):
+        for value in (lat_delta, lon_delta):
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+
+def simplified_polyline(lats, lons, tolerance):
+    """Упрощённая и закодированная линия трека плюс количество оставленных точек."""
+    indices = simplify(lats, lons, tolerance)
+    lats = np.asarray(lats, dtype=np.float64)[indices]
+    lons = np.asarray(lons, dtype=np.float64)[indices]
+    return encode_polyline(lats, lons), len(indices)
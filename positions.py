@@ -2,6 +2,7 @@ from flask import render_template, flash, url_for, redirect
 from flask_login import login_required, current_user
 import logging
 from datetime import datetime, date
+from sqlalchemy import func, case
 from kod import db, app
 from kod.models import ChallengeParticipants, Track, UserPosition, Challenge
 
@@ -58,6 +59,43 @@ def update_user_positions(challenge_id):
         logging.error(f"Ошибка при обновлении позиций для челленджа с ID: {challenge_id}: {e}")
         db.session.rollback()
 
+def get_position_changes(challenge_id, today):
+    """
+    Изменение позиции каждого участника за сегодня одним запросом.
+    ROW_NUMBER() по (user_id, сегодня/раньше) выбирает последнюю позицию за сегодня и последнюю до сегодня;
+    изменение = сегодняшняя - предыдущая (если есть обе). Возвращает {user_id: изменение}.
+    """
+    day_start = datetime.combine(today, datetime.min.time())
+    day_end = datetime.combine(today, datetime.max.time())
+    is_today = case((UserPosition.date_position >= day_start, 1), else_=0)
+
+    ranked = db.session.query(
+        UserPosition.user_id,
+        UserPosition.position,
+        is_today.label('is_today'),
+        func.row_number().over(
+            partition_by=(UserPosition.user_id, is_today),
+            order_by=UserPosition.date_position.desc()
+        ).label('row_number')
+    ).filter(
+        UserPosition.challenge_id == challenge_id,
+        UserPosition.date_position <= day_end
+    ).subquery()
+
+    rows = db.session.query(ranked.c.user_id, ranked.c.position, ranked.c.is_today).filter(ranked.c.row_number == 1)
+
+    current_positions = {}
+    previous_positions = {}
+    for user_id, position, today_flag in rows:
+        (current_positions if today_flag else previous_positions)[user_id] = position
+
+    return {
+        user_id: position - previous_positions[user_id]
+        for user_id, position in current_positions.items()
+        if user_id in previous_positions and position is not None and previous_positions[user_id] is not None
+    }
+
+
 @app.route('/challenge/<int:challenge_id>/detail', endpoint='challenge_detail_page')
 def challenge_detail(challenge_id):
     challenge = Challenge.query.get_or_404(challenge_id)
@@ -71,31 +109,14 @@ def challenge_detail(challenge_id):
     participants_data = []
     today = date.today()
 
-    for participant in participants:
-        # Получаем последнюю запись за сегодняшний день
-        last_position_today = (
-            UserPosition.query.filter_by(user_id=participant.user_id, challenge_id=challenge_id)
-            .filter(UserPosition.date_position >= datetime.combine(today, datetime.min.time()))
-            .filter(UserPosition.date_position <= datetime.combine(today, datetime.max.time()))
-            .order_by(UserPosition.date_position.desc())
-            .first()
-        )
-
-        # Получаем последнюю запись до сегодняшнего дня
-        last_position_before_today = (
-            UserPosition.query.filter_by(user_id=participant.user_id, challenge_id=challenge_id)
-            .filter(UserPosition.date_position < datetime.combine(today, datetime.min.time()))
-            .order_by(UserPosition.date_position.desc())
-            .first()
-        )
+    # Изменения позиций всех участников за сегодня одним запросом
+    position_changes = get_position_changes(challenge_id, today)
 
+    for participant in participants:
         # Инициализация переменных для вычисления изменения позиции
-        position_change = 0
+        position_change = position_changes.get(participant.user_id, 0)
         arrow = None
 
-        if last_position_today and last_position_before_today:
-            position_change = last_position_today.position - last_position_before_today.position
-
         if position_change > 0:
             arrow = "down-arrow"  # Ухудшение позиции (передвинулся вниз)
         elif position_change < 0:
@@ -1,10 +1,15 @@
-from flask import redirect, render_template, url_for, flash, session
+from flask import redirect, render_template, url_for, jsonify
 from flask_login import current_user, login_required
-from kod import app, db
+from datetime import datetime, timedelta
+import threading
+from kod import app
 from kod.models import Track, ChallengeParticipants, Challenge, User
 import logging
-import requests
-from kod.strava import token_is_expired, refresh_access_token, get_activities, save_tracks_to_db, update_strava_url_in_db, update_strava_sync_time
+from kod.background import submit_job, latest_job, is_active
+from kod.sync_tracks import sync_user
+
+# Не даёт двум запросам этого процесса одновременно запустить синхронизацию одного пользователя
+_refresh_jobs_lock = threading.Lock()
 
 
 @app.route('/profile')
@@ -21,22 +26,10 @@ def profile():
     # Получаем связанные данные Strava для текущего пользователя
     strava_data = user.strava_data  # Это объект Strava, связанный с пользователем
 
-    # Если пользователь аутентифицирован и токен истек, обновляем токен
-    if current_user.is_authenticated and strava_data and token_is_expired(current_user.id):
-        logging.info("Токен доступу скончаны ў %s. Аднаўляем!", current_user.id)
-        refresh_access_token(current_user.id)
-
-        # Получаем новый токен из сессии и сохраняем в базе данных
-        new_access_token = session.get('access_token')  # Новый токен из сессии
-        if new_access_token:
-            strava_data.access_token = new_access_token  # Обновляем токен в объекте Strava
-            db.session.commit()  # Сохраняем обновленный токен в базе данных
-            session['access_token'] = new_access_token  # Сохраняем новый токен в сессии
-            logging.info('Токен доступу адноўлены ў %s', current_user.login)
-        else:
-            logging.error("Не удалось обновить токен для пользователя %s", current_user.login)
-            session.pop('access_token', None)  # Очищаем сессию
-            return redirect(url_for('login_page'))  # Переход на страницу входа
+    # Синхронизация со Strava не блокирует страницу: если данные устарели, запускаем её в фоне
+    strava_syncing = False
+    if strava_data and strava_data.access_token:
+        strava_syncing = start_strava_refresh(user.id, strava_data)
 
     # Запрашиваем треки текущего пользователя в хронологическом порядке (новые сначала)
     logging.info('Просім трэкі са Страва: %s', current_user.login)
@@ -70,49 +63,7 @@ def profile():
 
     # Получаем токен из таблицы Strava, связанной с пользователем
     access_token = strava_data.access_token if strava_data else None
-
-    strava_profile_url = None
-    activities = None
-
-    if access_token:
-        logging.info('Токен доступу ёсць у %s', current_user.id)
-        try:
-            # Получаем данные профиля Strava
-            logging.info("Запрашываем інфу пра %s са Страва", current_user.login)
-            headers = {'Authorization': f'Bearer {access_token}'}
-            strava_profile_api_url = 'https://www.strava.com/api/v3/athlete'
-            response = requests.get(strava_profile_api_url, headers=headers)
-            response.raise_for_status()
-            strava_profile_data = response.json()
-
-            # Извлекаем athlete_id и формируем ссылку
-            athlete_id = strava_profile_data.get("id")
-            if athlete_id:
-                strava_profile_url = f"https://www.strava.com/athletes/{athlete_id}"
-                update_strava_url_in_db(current_user.id, strava_profile_url)
-
-            # Получаем активности
-            logging.info("Атрымліваем трэкі %s", current_user.login)
-            activities = get_activities(access_token)
-
-            # Сохраняем треки из Strava в базу данных
-            logging.info("Захоўваем трэкі ў базе дадзенных %s", current_user.login)
-            new_tracks_count = save_tracks_to_db(current_user.id, activities)
-
-            update_strava_sync_time(current_user.id)
-
-            # Формируем сообщение для пользователя
-            if new_tracks_count > 0:
-                flash(f"Запампавана {new_tracks_count} новых трэкаў!", "success")
-            else:
-                flash("Новых трэкаў няма!", "info")
-            logging.info(f"Запампавана {new_tracks_count} новых трэкаў {current_user.login}.")
-
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Памылка пры атрыманні дадзеных са Страва ў {current_user.login}: {e}")
-            strava_profile_url = None
-            activities = None
-            flash("Памылка пры запампаванні дадзеных у Strava.", "danger")
+    strava_profile_url = strava_data.strava_url if strava_data else None
 
     return render_template(
         'profile.html',
@@ -122,7 +73,43 @@ def profile():
         participant_challenges=participant_challenges_list,
         user=user,
         strava_profile_url=strava_profile_url,
-        activities=activities,
-        strava_profile_data=access_token
+        activities=None,
+        strava_profile_data=access_token,
+        strava_syncing=strava_syncing,
+        strava_sync_status_url=url_for('profile_sync_status')
     )
 
+
+def start_strava_refresh(user_id, strava_data):
+    """
+    Запускает фоновую синхронизацию пользователя, если последняя была раньше, чем
+    STRAVA_PROFILE_STALENESS_MINUTES назад. Возвращает True, если синхронизация сейчас идёт.
+    """
+    with _refresh_jobs_lock:
+        if is_active(latest_job('strava_refresh', user_id)):
+            return True
+
+        staleness = timedelta(minutes=app.config['STRAVA_PROFILE_STALENESS_MINUTES'])
+        if strava_data.synchron and strava_data.synchron > datetime.utcnow() - staleness:
+            return False
+
+        submit_job('strava_refresh', sync_user, user_id, owner_id=user_id)
+        logging.info("Фонавая сінхранізацыя са Страва запушчана для %s", user_id)
+        return True
+
+
+@app.route('/profile/sync_status')
+@login_required
+def profile_sync_status():
+    """Состояние фоновой синхронизации со Strava для страницы профиля."""
+    job = latest_job('strava_refresh', current_user.id)
+    if not job:
+        return jsonify({'status': 'idle'})
+
+    response = {'status': job['status']}
+    if job['status'] == 'done':
+        response['new_tracks'] = job['result']['new_tracks']
+    elif job['status'] == 'failed':
+        response['error'] = 'Памылка пры запампаванні дадзеных у Strava.'
+    return jsonify(response)
+
@@ -7,6 +7,7 @@ from sqlalchemy.exc import SQLAlchemyError
 from kod import app, db, mail
 from kod.models import User, Challenge, ChallengeParticipants
 
+from kod.cache import clear_session_data
 from kod.statistics import count_challenges, count_total_distance, count_tracks, count_users
 
 login_manager = LoginManager()
@@ -82,6 +83,7 @@ def login_page():
         if login and password:
             user = User.query.filter_by(login=login).first()
             if user and check_password_hash(user.password, password):
+                clear_session_data()  # Новый ключ серверной сессии: данные прежнего пользователя не видны
                 login_user(user, remember=True)
                 session['id'] = user.login
                 app.logger.info(f'Пользователь {session["id"]} вошел в систему.')
@@ -148,6 +150,7 @@ def register():
 @login_required
 def logout():
     app.logger.debug(f"Пользователь {session['id']} вышел из системы.")
+    clear_session_data()
     logout_user()
     return redirect(url_for('home'))
 
@@ -1,4 +1,6 @@
 from kod import app
+from kod.scheduler import start_scheduler
 
 if __name__ == '__main__':
+    start_scheduler()
     app.run()
\ No newline at end of file
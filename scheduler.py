@@ -0,0 +1,180 @@
+from datetime import datetime, timedelta
+import logging
+import threading
+import atexit
+import random
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.triggers.interval import IntervalTrigger
+from sqlalchemy import text
+
+from kod import app, db
+from kod.models import Strava
+from kod.strava_ratelimit import BATCH
+from kod.sync_tracks import sync_user
+
+# Имя блокировки MySQL: планировщик запускается только в процессе, который её держит
+SCHEDULER_LOCK_NAME = 'kod_strava_scheduler'
+
+scheduler = None
+_lock_connection = None
+_retry_timer = None
+
+
+def user_job_id(user_id):
+    return f'strava_sync_{user_id}'
+
+
+def run_user_sync(user_id):
+    """Периодическая синхронизация одного пользователя (вызывается планировщиком)."""
+    with app.app_context():
+        try:
+            result = sync_user(user_id, BATCH)
+            logging.info(f"Плановая синхронизация пользователя {user_id}: {result}")
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Ошибка плановой синхронизации пользователя {user_id}: {e}", exc_info=True)
+        finally:
+            db.session.remove()
+
+
+def schedule_user_syncs():
+    """
+    Сверяет задачи планировщика с подключёнными к Strava пользователями.
+    Новым пользователям первый запуск назначается в случайный момент интервала; уже сохранённые
+    задачи не пересоздаются, поэтому после перезапуска их расписание не сбивается в одну точку.
+    """
+    interval = app.config['STRAVA_POLL_INTERVAL_MINUTES']
+    with app.app_context():
+        try:
+            user_ids = {user_id for (user_id,) in db.session.query(Strava.user_id)}
+        finally:
+            db.session.remove()
+
+    scheduled = {job.id for job in scheduler.get_jobs() if job.id.startswith('strava_sync_')}
+    wanted = {user_job_id(user_id): user_id for user_id in user_ids}
+
+    for job_id, user_id in wanted.items():
+        if job_id in scheduled:
+            continue
+        scheduler.add_job(
+            'kod.scheduler:run_user_sync',
+            IntervalTrigger(minutes=interval, jitter=app.config['STRAVA_POLL_JITTER_SECONDS']),
+            args=[user_id],
+            id=job_id,
+            next_run_time=datetime.utcnow() + timedelta(seconds=random.uniform(0, interval * 60)),
+            replace_existing=False
+        )
+
+    for job_id in scheduled - set(wanted):
+        scheduler.remove_job(job_id)
+
+    logging.info(f"Планировщик: {len(wanted)} пользователей Strava, добавлено {len(set(wanted) - scheduled)}.")
+
+
+def _acquire_scheduler_lock():
+    """
+    Берёт именованную блокировку MySQL на отдельном соединении. Блокировка живёт, пока открыто
+    соединение, поэтому из нескольких воркеров gunicorn планировщик запустит только один.
+    """
+    global _lock_connection
+    with app.app_context():
+        connection = db.engine.connect()
+    acquired = connection.execute(text("SELECT GET_LOCK(:name, 0)"), {'name': SCHEDULER_LOCK_NAME}).scalar()
+    if acquired == 1:
+        _lock_connection = connection
+        return True
+    connection.close()
+    return False
+
+
+def _keep_lock_alive():
+    """
+    Держит соединение с блокировкой активным, чтобы MySQL не закрыл его по wait_timeout.
+    Если соединение потеряно, блокировка уже свободна и её может взять другой процесс,
+    поэтому этот планировщик останавливается.
+    """
+    try:
+        _lock_connection.execute(text("SELECT 1"))
+    except Exception as e:
+        logging.error(f"Потеряно соединение с блокировкой планировщика, останавливаем планировщик: {e}")
+        stop_scheduler()
+        _schedule_lock_retry()
+
+
+def _schedule_lock_retry():
+    """
+    Через SCHEDULER_LOCK_RETRY_SECONDS снова пробует взять блокировку и запустить планировщик.
+    Так его подхватит другой воркер, если процесс с планировщиком завершился или потерял соединение.
+    """
+    global _retry_timer
+    _retry_timer = threading.Timer(app.config['SCHEDULER_LOCK_RETRY_SECONDS'], start_scheduler)
+    _retry_timer.daemon = True
+    _retry_timer.start()
+
+
+def start_scheduler():
+    """
+    Запускает планировщик, если он включён (SCHEDULER_ENABLED) и этот процесс получил блокировку.
+    Вызывается явно из точки входа веб-сервера (run.py, хук post_fork в gunicorn.conf.py),
+    а не при импорте модуля, чтобы команды flask и скрипты не запускали планировщик.
+    """
+    global scheduler
+    if not app.config['SCHEDULER_ENABLED']:
+        return None
+    if scheduler is not None:
+        return scheduler
+
+    try:
+        if not _acquire_scheduler_lock():
+            logging.info("Планировщик уже запущен в другом процессе.")
+            _schedule_lock_retry()
+            return None
+    except Exception as e:
+        logging.error(f"Не удалось получить блокировку планировщика: {e}")
+        _schedule_lock_retry()
+        return None
+
+    with app.app_context():
+        jobstore = SQLAlchemyJobStore(engine=db.engine, tablename='apscheduler_jobs')
+
+    scheduler = BackgroundScheduler(
+        jobstores={'default': jobstore},
+        executors={'default': ThreadPoolExecutor(app.config['SCHEDULER_WORKERS'])},
+        job_defaults={
+            'coalesce': True,  # Пропущенные за время простоя запуски выполняются один раз
+            'max_instances': 1,
+            'misfire_grace_time': app.config['STRAVA_POLL_INTERVAL_MINUTES'] * 60
+        },
+        timezone='UTC'
+    )
+    scheduler.start()
+
+    # Служебные задачи хранятся в памяти и пересоздаются при каждом запуске
+    scheduler.add_jobstore('memory', alias='internal')
+    scheduler.add_job(schedule_user_syncs, 'interval', minutes=60, id='schedule_user_syncs',
+                      jobstore='internal', next_run_time=datetime.utcnow())
+    scheduler.add_job(_keep_lock_alive, 'interval', minutes=1, id='keep_lock_alive', jobstore='internal')
+
+    atexit.register(stop_scheduler)
+    logging.info("Планировщик синхронизации Strava запущен.")
+    return scheduler
+
+
+def stop_scheduler():
+    """Останавливает планировщик и освобождает блокировку."""
+    global scheduler, _lock_connection, _retry_timer
+    if _retry_timer is not None:
+        _retry_timer.cancel()
+        _retry_timer = None
+    if scheduler is not None:
+        scheduler.shutdown(wait=False)
+        scheduler = None
+    if _lock_connection is not None:
+        try:
+            _lock_connection.close()
+        except Exception as e:
+            logging.warning(f"Не удалось закрыть соединение с блокировкой планировщика: {e}")
+        _lock_connection = None
@@ -1,10 +1,18 @@
 import os
-import requests
-from flask import redirect, request, session, url_for, render_template, flash
+from flask import redirect, request, url_for, render_template, flash, jsonify
 from datetime import datetime, timedelta
 from flask_login import login_required, current_user
 from kod import app, db
 from kod.models import Track, Strava, User
+from sqlalchemy import func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.exc import SQLAlchemyError
+from kod.admin import admin_required
+from kod.strava_ratelimit import rate_limiter, StravaError, INTERACTIVE
+from kod.strava_client import StravaClient, StravaHTTPError
+from kod.strava_tokens import StravaTokenManager
+from kod.cache import get_session_data, set_session_data
+from kod.challenges import invalidate_daily_distances
 import logging
 
 # Ваши данные клиента, полученные при регистрации приложения в Strava
@@ -18,8 +26,21 @@ app.secret_key = os.urandom(24)
 # URL для аутентификации в Strava
 AUTH_URL = f'https://www.strava.com/oauth/authorize?client_id={CLIENT_ID}&response_type=code&redirect_uri={REDIRECT_URI}&scope=read,read_all,activity:read'
 
-# URL для обмена кода на токен
-TOKEN_URL = 'https://www.strava.com/oauth/token'
+# Общий клиент API Strava (пул соединений, таймауты, повторы, квота)
+strava_client = StravaClient(
+    CLIENT_ID,
+    CLIENT_SECRET,
+    rate_limiter,
+    base_url=app.config['STRAVA_API_BASE_URL'],
+    timeout=app.config['STRAVA_API_TIMEOUT'],
+    connect_timeout=app.config['STRAVA_API_CONNECT_TIMEOUT'],
+    max_retries=app.config['STRAVA_API_MAX_RETRIES'],
+    backoff=app.config['STRAVA_API_BACKOFF'],
+    pool_size=app.config['STRAVA_API_POOL_SIZE']
+)
+
+# Токены доступа пользователей: кэш и заблаговременное обновление по одному на пользователя
+token_manager = StravaTokenManager(strava_client, app.config['STRAVA_TOKEN_REFRESH_MARGIN'])
 
 
 @app.route('/')
@@ -35,37 +56,29 @@ def callback():
     if not code:
         return 'Ошибка: отсутствует код авторизации Strava.', 400
 
-    data = {
-        'client_id': CLIENT_ID,
-        'client_secret': CLIENT_SECRET,
-        'code': code,
-        'grant_type': 'authorization_code'
-    }
+    try:
+        token_data = strava_client.exchange_token(code)
+    except StravaHTTPError as e:
+        print(f"Token Exchange Error: {e}")
+        return f'Ошибка при обмене кода на токен. Статус: {e.status_code}', 500
+    except StravaError as e:
+        print(f"Token Exchange Error: {e}")
+        return 'Ошибка при обмене кода на токен.', 500
 
-    response = requests.post(TOKEN_URL, data=data)
-    if response.status_code == 200:
-        token_data = response.json()
-        print(f"Token Data: {token_data}")
-        access_token = token_data['access_token']
-        refresh_token = token_data['refresh_token']
-        expires_at = token_data.get('expires_at')
-
-        save_strava_tokens(current_user.id, access_token, refresh_token, expires_at)
-
-        headers = {'Authorization': f'Bearer {access_token}'}
-        strava_profile_url = 'https://www.strava.com/api/v3/athlete'
-        profile_response = requests.get(strava_profile_url, headers=headers)
-        if profile_response.status_code == 200:
-            profile_data = profile_response.json()
-            strava_url = f"https://www.strava.com/athletes/{profile_data['id']}"
-            update_strava_url_in_db(current_user.id, strava_url)
-        else:
-            print(f"Profile Fetch Error: {profile_response.status_code} - {profile_response.text}")
+    access_token = token_data['access_token']
+    refresh_token = token_data['refresh_token']
+    expires_at = token_data.get('expires_at')
+
+    save_strava_tokens(current_user.id, access_token, refresh_token, expires_at)
 
-        return redirect(url_for('profile'))
-    else:
-        print(f"Token Exchange Error: {response.status_code} - {response.text}")
-        return f'Ошибка при обмене кода на токен. Статус: {response.status_code}', 500
+    try:
+        profile_data = strava_client.get_athlete(access_token)
+        strava_url = f"https://www.strava.com/athletes/{profile_data['id']}"
+        update_strava_url_in_db(current_user.id, strava_url)
+    except StravaError as e:
+        print(f"Profile Fetch Error: {e}")
+
+    return redirect(url_for('profile'))
 
 
 
@@ -80,33 +93,26 @@ def strava_profile():
         flash("Вы не синхронизированы с Strava. Пожалуйста, выполните синхронизацию.", "warning")
         return redirect(url_for('sync'))  # Перенаправление на страницу синхронизации
 
-    access_token = session.get('access_token')
+    access_token = token_manager.get_token(current_user.id, strava_data)
     if not access_token:
         logging.debug(f"У пользователя {current_user.id} нет токена доступа Strava.")
         return redirect(url_for('strava_sync'))
 
-    strava_profile_data = session.get('strava_profile_data')
-    activities = session.get('strava_activities')
+    strava_profile_data = get_session_data('strava_profile_data')
+    activities = get_session_data('strava_activities')
 
     if not strava_profile_data or not activities:
-        if token_is_expired():
-            refresh_access_token()
-
         try:
-            headers = {'Authorization': f'Bearer {access_token}'}
-            strava_profile_url = 'https://www.strava.com/api/v3/athlete'
-            response = requests.get(strava_profile_url, headers=headers)
-            response.raise_for_status()
-            strava_profile_data = response.json()
-            session['strava_profile_data'] = strava_profile_data
+            strava_profile_data = strava_client.get_athlete(access_token)
+            set_session_data('strava_profile_data', strava_profile_data)
 
             activities = get_activities(access_token)
-            session['strava_activities'] = activities
+            set_session_data('strava_activities', activities)
 
             strava_url = f"https://www.strava.com/athletes/{strava_profile_data['id']}"
             update_strava_url_in_db(current_user.id, strava_url)
 
-        except requests.exceptions.RequestException as e:
+        except StravaError as e:
             logging.error(f"Ошибка при получении данных с Strava для пользователя {current_user.id}: {e}")
             flash("Ошибка при загрузке данных с Strava.", "danger")
 
@@ -141,69 +147,26 @@ def update_strava_url_in_db(user_id, strava_url):
         logging.info(f"Ошибка при обновлении Strava URL для пользователя с ID {user_id}: {e}")
 
 
-def refresh_access_token(user_id):
-    """Обновление токена с использованием refresh_token."""
-    strava_data = Strava.query.filter_by(user_id=user_id).first()
-    if not strava_data or not strava_data.refresh_token:
-        logging.error(f"Не удалось найти refresh_token для пользователя {user_id}.")
-        return None
-
-    refresh_data = {
-        'client_id': CLIENT_ID,
-        'client_secret': CLIENT_SECRET,
-        'refresh_token': strava_data.refresh_token,
-        'grant_type': 'refresh_token'
-    }
-
-    response = requests.post(TOKEN_URL, data=refresh_data)
-    if response.status_code == 200:
-        token_data = response.json()
-        strava_data.access_token = token_data['access_token']
-        strava_data.refresh_token = token_data['refresh_token']
-        strava_data.token_expires_at = datetime.utcfromtimestamp(token_data['expires_at'])
-        db.session.commit()
-        logging.info(f"Токен обновлён для пользователя {user_id}.")
-        return strava_data.access_token
-    else:
-        logging.error(f"Ошибка при обновлении токена для пользователя {user_id}.")
-        return None
-
-
-
-
-
-def token_is_expired(user_id):
-    """Проверка, истёк ли токен пользователя."""
-    strava_data = Strava.query.filter_by(user_id=user_id).first()
-    if strava_data and strava_data.token_expires_at:
-        current_time = datetime.utcnow()
-        return strava_data.token_expires_at < current_time
-    return True
-
-
 @app.route('/activities')
+@login_required
 def activities():
     """Получение активностей пользователя через API Strava и отображение GPX ссылок."""
-    access_token = session.get('access_token')
+    access_token = token_manager.get_token(current_user.id)
     if not access_token:
         return redirect(url_for('index'))  # Перенаправление на авторизацию, если нет токена
 
-    if token_is_expired():
-        refresh_access_token(current_user.id)  # Передаем user_id
-
-    headers = {'Authorization': f'Bearer {access_token}'}
-    activities_url = 'https://www.strava.com/api/v3/athlete/activities'
-    response = requests.get(activities_url, headers=headers)
+    try:
+        activities_data = strava_client.get_activities(access_token, per_page=30)
+    except StravaHTTPError as e:
+        return f'Ошибка при получении данных активностей. Статус: {e.status_code}', 500
+    except StravaError as e:
+        return f'Ошибка при получении данных активностей: {e}', 503
 
-    if response.status_code == 200:
-        activities_data = response.json()
-        activities_list = ''
-        for activity in activities_data:
-            activities_list += f"{activity['name']} - {activity['distance'] / 1000} км<br>"
-            activities_list += f"<a href='{url_for('download_gpx', activity_id=activity['id'])}'>Скачать GPX</a><br><br>"
-        return activities_list
-    else:
-        return f'Ошибка при получении данных активностей. Статус: {response.status_code}', 500
+    activities_list = ''
+    for activity in activities_data:
+        activities_list += f"{activity['name']} - {activity['distance'] / 1000} км<br>"
+        activities_list += f"<a href='{url_for('download_gpx', activity_id=activity['id'])}'>Скачать GPX</a><br><br>"
+    return activities_list
 
 
 @app.route('/strava_sync')
@@ -213,50 +176,50 @@ def sync():
     return render_template('strava_sync.html', auth_url=AUTH_URL)
 
 
-def get_activities(access_token):
-    """Получение ВСЕХ активностей пользователя за последние 60 дней через API Strava с пагинацией."""
-    activities_url = 'https://www.strava.com/api/v3/athlete/activities'
-    headers = {'Authorization': f'Bearer {access_token}'}
-    cutoff_date = datetime.now() - timedelta(days=60)
+@app.route('/strava/rate_limit')
+@admin_required
+def strava_rate_limit():
+    """Остаток квоты API Strava для администратора."""
+    return jsonify(rate_limiter.remaining())
+
+
+def get_sync_cursor(strava_data):
+    """
+    Момент, начиная с которого запрашивать активности при синхронизации.
+    Берём время последней успешной синхронизации с запасом STRAVA_SYNC_OVERLAP_HOURS,
+    чтобы не пропустить активности, загруженные в Strava с опозданием.
+    """
+    if not strava_data or not strava_data.synchron:
+        return None
+    return strava_data.synchron - timedelta(hours=app.config['STRAVA_SYNC_OVERLAP_HOURS'])
+
+
+def get_activities(access_token, priority=INTERACTIVE, after=None):
+    """
+    Получение активностей пользователя через API Strava с пагинацией.
+    after (UTC) — курсор инкрементальной синхронизации: запрашиваются только активности,
+    начатые позже него, но не раньше чем за 60 дней. Без курсора берутся все 60 дней.
+    priority=BATCH для фоновой синхронизации: такие запросы пропускают интерактивные вперёд.
+    """
+    cutoff_date = datetime.utcnow() - timedelta(days=60)
+    if after is None or after < cutoff_date:
+        after = cutoff_date
     recent_activities = []
     page = 1
     per_page = 200  # Максимальное количество активностей на странице
 
-    logging.info("Начало получения активностей с пагинацией...")
+    logging.info(f"Начало получения активностей после {after} с пагинацией...")
 
     while True:
-        params = {'page': page, 'per_page': per_page}
-        response = requests.get(activities_url, headers=headers, params=params)
-
-        # Прерываем цикл при ошибке запроса
-        if response.status_code != 200:
-            logging.error(f"Ошибка запроса. Страница: {page}, Статус: {response.status_code}")
-            break
-
-        activities_data = response.json()
-        
-        # Прерываем цикл, если данных больше нет
-        if not activities_data:
-            logging.info(f"Страница {page} пустая. Прекращаем пагинацию.")
-            break
-
+        # С параметром after Strava отдаёт активности от старых к новым.
+        # 429 и 5xx повторяет клиент; оставшуюся ошибку не глотаем, а сообщаем вызывающему коду
+        activities_data = strava_client.get_activities(access_token, after, page, per_page, priority)
+        recent_activities.extend(activities_data)
         logging.info(f"Обработка страницы {page} ({len(activities_data)} активностей)...")
 
-        # Флаг для остановки обработки при обнаружении старой активности
-        stop_processing = False
-        
-        for activity in activities_data:
-            activity_date = datetime.strptime(activity['start_date'], '%Y-%m-%dT%H:%M:%SZ')
-            
-            if activity_date >= cutoff_date:
-                recent_activities.append(activity)
-            else:
-                logging.info(f"Найдена активность от {activity_date}. Прекращаем обработку.")
-                stop_processing = True
-                break  # Выход из цикла по активностям
-
-        if stop_processing:
-            break  # Выход из основного цикла пагинации
+        # Неполная страница — дальше активностей нет
+        if len(activities_data) < per_page:
+            break
 
         page += 1
 
@@ -274,99 +237,142 @@ def get_user_by_id(user_id):
 
     return user  # Возвращаем пользователя
 
-def save_tracks_to_db(user_id, activities):
-    """Сохраняет треки из Strava в базу данных и возвращает количество новых треков."""
+def activity_to_track_row(user_id, activity):
+    """Преобразует активность Strava в строку таблицы gpx."""
+    activity_id = activity['id']
+    return {
+        'user_id': user_id,
+        'filename': str(activity_id),
+        'name_track': activity.get('name', f"Активность {activity_id}"),
+        'distance': round(activity['distance'] / 1000, 2),
+        'duration': str(timedelta(seconds=activity['moving_time'])),
+        'upload_time': datetime.utcnow(),
+        'record_time': datetime.strptime(activity['start_date'], '%Y-%m-%dT%H:%M:%SZ'),
+        'height': activity['total_elevation_gain'],
+        'net_duration': str(timedelta(seconds=activity['elapsed_time'])),
+        'type': activity.get('type', 'Unknown')
+    }
+
+
+def ingest_activities(user_id, activities):
+    """
+    Пакетно и идемпотентно сохраняет активности Strava как треки.
+    Уже сохранённые активности отсекаются одним запросом IN, новые вставляются одним
+    INSERT ... ON DUPLICATE KEY UPDATE (гонка с параллельной синхронизацией не даёт ошибки
+    уникальности) и фиксируются одним коммитом. Если пакет отклонён базой, строки вставляются
+    по одной, чтобы одна плохая строка не теряла остальные.
+    Возвращает количество вставленных, пропущенных и не записанных из-за ошибок базы (errors).
+    """
+    report = {'inserted': 0, 'skipped': 0, 'errors': 0}
     if not activities:
         logging.info("Нет активностей для сохранения.")
-        return 0
+        return report
 
     user = get_user_by_id(user_id)
     if not user:
         logging.error(f"Не удалось получить данные пользователя с ID {user_id}. Прерываем сохранение.")
-        return 0
-
-    username = user.login
-    new_tracks_count = 0
+        report['skipped'] = len(activities)
+        return report
 
+    # Общее время загрузки пакета (с точностью до секунды, как в колонке) отличает наши строки от чужих
+    upload_time = datetime.utcnow().replace(microsecond=0)
+    rows = {}
     for activity in activities:
         activity_id = activity.get('id')
         if not activity_id:
             logging.error("Отсутствует ID активности. Пропускаем.")
-            continue
-
-        # Проверяем, существует ли уже трек в базе данных
-        existing_track = Track.query.filter_by(filename=str(activity_id)).first()
-        if existing_track:
+            report['skipped'] += 1
             continue
 
         try:
-            # Преобразуем данные активности
-            duration_str = str(timedelta(seconds=activity['moving_time']))
-            net_duration_str = str(timedelta(seconds=activity['elapsed_time']))
-            distance_km = activity['distance'] / 1000
-            distance_str = f"{distance_km:.2f}"
-
-            logging.info(f"Сохранение трека: ID={activity_id}, Название={activity.get('name')}, Дистанция={distance_str} км")
-
-            # Создаем новый трек
-            new_track = Track(
-                user_id=user.id,
-                filename=str(activity_id),
-                name_track=activity.get('name', f"Активность {activity_id}"),
-                distance=distance_str,
-                duration=duration_str,
-                upload_time=datetime.utcnow(),
-                record_time=datetime.strptime(activity['start_date'], '%Y-%m-%dT%H:%M:%SZ'),
-                height=activity['total_elevation_gain'],
-                net_duration=net_duration_str,
-                type=activity.get('type', 'Unknown')
-            )
-
-            # Сохраняем трек в базу данных
-            db.session.add(new_track)
-            db.session.commit()
-            new_tracks_count += 1
-            logging.info(f"Трек {activity_id} успешно сохранен для пользователя {username}.")
-
-        except Exception as e:
+            rows[str(activity_id)] = dict(activity_to_track_row(user.id, activity), upload_time=upload_time)
+        except (KeyError, TypeError, ValueError) as e:
+            logging.error(f"Некорректные данные активности {activity_id} пользователя {user.login}: {e}")
+            report['skipped'] += 1
+
+    # Одна проверка существующих треков на весь пакет
+    existing = set()
+    if rows:
+        existing = {filename for (filename,) in db.session.query(Track.filename).filter(Track.filename.in_(list(rows)))}
+    new_rows = [row for filename, row in rows.items() if filename not in existing]
+    report['skipped'] += len(rows) - len(new_rows)
+
+    if new_rows:
+        try:
+            _insert_track_rows(new_rows)
+        except SQLAlchemyError as e:
             db.session.rollback()  # Откатываем транзакцию в случае ошибки
-            logging.error(f"Ошибка при сохранении трека {activity_id} для пользователя {username}: {e}", exc_info=True)
+            logging.warning(f"Пакет треков пользователя {user.login} отклонён, вставляем по одному: {e}")
+            for row in new_rows:
+                try:
+                    _insert_track_rows([row])
+                except SQLAlchemyError as e:
+                    db.session.rollback()
+                    logging.error(f"Ошибка при сохранении активности {row['filename']} пользователя {user.login}: {e}")
+                    report['errors'] += 1
+        inserted = _count_inserted_tracks([row['filename'] for row in new_rows], upload_time)
+        report['inserted'] = inserted
+        report['skipped'] += len(new_rows) - inserted - report['errors']
+        if inserted:
+            invalidate_daily_distances([user.id])
+
+    logging.info(
+        f"Треки Strava пользователя {user.login}: добавлено {report['inserted']}, "
+        f"пропущено {report['skipped']}, ошибок {report['errors']}."
+    )
+    return report
+
+
+def _insert_track_rows(rows):
+    """
+    Вставляет строки треков одним INSERT ... ON DUPLICATE KEY UPDATE и фиксирует транзакцию.
+    Число вставленных строк по rowcount не узнать: диалект mysqlconnector включает CLIENT_FOUND_ROWS,
+    и строка-дубль тоже считается затронутой. Вставленные строки считает _count_inserted_tracks.
+    """
+    statement = mysql_insert(Track.__table__).values(rows)
+    statement = statement.on_duplicate_key_update(filename=statement.inserted.filename)
+    db.session.execute(statement)
+    db.session.commit()
+
 
-    return new_tracks_count
+def _count_inserted_tracks(filenames, upload_time):
+    """
+    Сколько из filenames записано этим пакетом: строки-дубли остались с временем загрузки
+    параллельной синхронизации, а наши получили upload_time пакета.
+    """
+    return db.session.query(func.count(Track.id)).filter(
+        Track.filename.in_(filenames),
+        Track.upload_time == upload_time
+    ).scalar()
+
+
+def save_tracks_to_db(user_id, activities):
+    """Сохраняет треки из Strava в базу данных и возвращает количество новых треков."""
+    return ingest_activities(user_id, activities)['inserted']
 
 @app.route('/sync_strava_tracks', methods=['GET', 'POST'])
 @login_required
 def sync_strava_tracks():
     logging.info(f"Пачынаем сінхранізацыю рукамі")
     """Синхронизация данных с Strava."""
-    access_token = session.get('access_token')
-    strava_profile_data = session.get('strava_profile_data')
-    activities = session.get('strava_activities')
+    access_token = token_manager.get_token(current_user.id)
+    strava_profile_data = get_session_data('strava_profile_data')
+    activities = get_session_data('strava_activities')
 
     if access_token:
         logging.info(f"Токен доступа найден для пользователя {current_user.id}.")
 
         if not strava_profile_data or not activities:
-            if token_is_expired(current_user.id):
-                logging.info(f"Токен доступа для пользователя {current_user.id} истек.")
-                refresh_access_token()
-                access_token = session.get('access_token')
-                logging.info(f"Токен доступа обновлен для пользователя {current_user.id}.")
-
             try:
                 # Связь с Strava API для получения данных профиля
                 logging.info(f"Связываемся с Strava для пользователя {current_user.id}.")
-                headers = {'Authorization': f'Bearer {access_token}'}
-                strava_profile_url = 'https://www.strava.com/api/v3/athlete'
-                response = requests.get(strava_profile_url, headers=headers)
-                response.raise_for_status()
-                strava_profile_data = response.json()
-                session['strava_profile_data'] = strava_profile_data
+                strava_profile_data = strava_client.get_athlete(access_token)
+                set_session_data('strava_profile_data', strava_profile_data)
                 logging.info(f"Данные профиля Strava успешно сохранены для пользователя {current_user.id}.")
 
                 # Получение списка активностей
                 activities = get_activities(access_token)
-                session['strava_activities'] = activities
+                set_session_data('strava_activities', activities)
                 logging.info(f"Получено {len(activities)} активностей для пользователя {current_user.id}.")
 
                 # Обновление ссылки на Strava в базе данных
@@ -374,7 +380,7 @@ def sync_strava_tracks():
                 update_strava_url_in_db(current_user.id, strava_url)
                 logging.info(f"Ссылка на профиль Strava обновлена для пользователя {current_user.id}.")
 
-            except requests.exceptions.RequestException as e:
+            except StravaError as e:
                 logging.error(f"Ошибка при получении данных с Strava для пользователя {current_user.id}: {e}")
                 flash("Ошибка при загрузке данных с Strava.", "danger")
 
@@ -395,6 +401,7 @@ def save_strava_tokens(user_id, access_token, refresh_token, expires_at):
     strava_data.refresh_token = refresh_token
     strava_data.token_expires_at = datetime.utcfromtimestamp(expires_at)
     db.session.commit()
+    token_manager.store(user_id, access_token, strava_data.token_expires_at)
 
 def update_strava_sync_time(user_id):
     """Обновление времени последней синхронизации со Strava."""
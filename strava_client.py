@@ -0,0 +1,125 @@
+import calendar
+import logging
+import random
+import time
+
+import httpx
+
+from kod.strava_ratelimit import StravaError, INTERACTIVE
+
+try:
+    import h2  # noqa: F401
+    HTTP2 = True
+except ImportError:  # без пакета h2 клиент работает по HTTP/1.1 с keep-alive
+    HTTP2 = False
+
+STRAVA_BASE_URL = 'https://www.strava.com'
+
+# Ответы, после которых запрос имеет смысл повторить
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class StravaHTTPError(StravaError):
+    """Strava ответила ошибкой (после всех повторов)."""
+
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        super().__init__(f"Strava API {response.request.method} {response.request.url.path}: "
+                         f"{response.status_code} - {response.text[:200]}")
+
+
+class StravaClient:
+    """
+    Клиент API Strava: общий пул соединений (keep-alive, HTTP/2 при наличии h2), таймауты
+    на каждый запрос и повторы с экспоненциальной задержкой и джиттером на 5xx, 429 и сетевых ошибках.
+    Запросы к API проходят через общий планировщик квоты (kod.strava_ratelimit).
+    """
+
+    def __init__(self, client_id, client_secret, limiter, base_url=STRAVA_BASE_URL, timeout=10.0,
+                 connect_timeout=5.0, max_retries=3, backoff=0.5, pool_size=20):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._http = httpx.Client(
+            base_url=base_url,
+            http2=HTTP2,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+
+    def _retry_delay(self, attempt):
+        """Экспоненциальная задержка с полным джиттером: случайно от 0 до backoff * 2^attempt."""
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+    def request(self, method, path, access_token=None, priority=INTERACTIVE, rate_limited=True, **kwargs):
+        """
+        Выполняет запрос с повторами и возвращает успешный httpx.Response.
+        При исчерпании повторов бросает StravaHTTPError или StravaError (сетевая ошибка).
+        """
+        headers = kwargs.pop('headers', {})
+        if access_token:
+            headers['Authorization'] = f'Bearer {access_token}'
+
+        for attempt in range(self.max_retries + 1):
+            if rate_limited:
+                self.limiter.acquire(priority)
+
+            try:
+                response = self._http.request(method, path, headers=headers, **kwargs)
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise StravaError(f"Strava API {method} {path}: {e}") from e
+                delay = self._retry_delay(attempt)
+                logging.warning(f"Strava API {method} {path}: {e}. Повтор через {delay:.1f} с.")
+                time.sleep(delay)
+                continue
+
+            if rate_limited:
+                self.limiter.update_from_headers(response.headers)
+                if response.status_code == 429:
+                    self.limiter.mark_exhausted()
+
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                # После 429 ждать нового окна квоты будет сам планировщик при следующем acquire()
+                delay = 0 if response.status_code == 429 and rate_limited else self._retry_delay(attempt)
+                logging.warning(f"Strava API {method} {path}: {response.status_code}. Повтор через {delay:.1f} с.")
+                time.sleep(delay)
+                continue
+
+            if response.is_error:
+                raise StravaHTTPError(response)
+            return response
+
+    def get_athlete(self, access_token, priority=INTERACTIVE):
+        """Профиль спортсмена (dict)."""
+        return self.request('GET', '/api/v3/athlete', access_token, priority).json()
+
+    def get_activities(self, access_token, after=None, page=1, per_page=200, priority=INTERACTIVE):
+        """Одна страница активностей спортсмена (list); after — datetime UTC."""
+        params = {'page': page, 'per_page': per_page}
+        if after is not None:
+            params['after'] = calendar.timegm(after.timetuple())
+        return self.request('GET', '/api/v3/athlete/activities', access_token, priority, params=params).json()
+
+    def get_activity(self, access_token, activity_id, priority=INTERACTIVE):
+        """Одна активность по её id (dict)."""
+        return self.request('GET', f'/api/v3/activities/{activity_id}', access_token, priority).json()
+
+    def exchange_token(self, code):
+        """Обмен кода авторизации на токены (dict с access_token, refresh_token, expires_at, athlete)."""
+        return self._token_request({'code': code, 'grant_type': 'authorization_code'})
+
+    def refresh_token(self, refresh_token):
+        """Обновление токена доступа (dict с access_token, refresh_token, expires_at)."""
+        return self._token_request({'refresh_token': refresh_token, 'grant_type': 'refresh_token'})
+
+    def _token_request(self, data):
+        # Запросы OAuth не расходуют квоту API
+        data = dict(data, client_id=self.client_id, client_secret=self.client_secret)
+        return self.request('POST', '/oauth/token', rate_limited=False, data=data).json()
+
+    def close(self):
+        self._http.close()
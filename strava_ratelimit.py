@@ -0,0 +1,160 @@
+from datetime import datetime, timedelta
+import threading
+import logging
+import time
+
+from kod import app
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+
+SHORT_WINDOW_SECONDS = 15 * 60
+
+
+class StravaError(Exception):
+    """Базовая ошибка обращения к API Strava."""
+
+
+class StravaRateLimitExceeded(StravaError):
+    """Квота Strava исчерпана, и ждать её восстановления дольше допустимого."""
+
+
+def _next_quarter_hour(now):
+    """Начало следующего 15-минутного окна Strava (окна выровнены по :00, :15, :30, :45 UTC)."""
+    floored = now.replace(minute=now.minute - now.minute % 15, second=0, microsecond=0)
+    return floored + timedelta(minutes=15)
+
+
+def _next_midnight(now):
+    return (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class StravaRateLimiter:
+    """
+    Общий планировщик запросов к API Strava по двум окнам квоты: 15-минутному и суточному.
+    Перед каждым запросом вызывается acquire(), после ответа — update_from_headers().
+    Интерактивные запросы идут вперёд пакетной синхронизации: для них оставляется резерв квоты,
+    а пакетные запросы равномерно распределяются по остатку 15-минутного окна.
+    """
+
+    def __init__(self, short_limit, daily_limit, interactive_reserve, interactive_max_wait):
+        self.short_limit = short_limit
+        self.daily_limit = daily_limit
+        self.interactive_reserve = interactive_reserve
+        self.interactive_max_wait = interactive_max_wait
+
+        self.short_usage = 0
+        self.daily_usage = 0
+
+        now = datetime.utcnow()
+        self._short_reset = _next_quarter_hour(now)
+        self._daily_reset = _next_midnight(now)
+        self._next_batch_slot = 0.0
+        self._interactive_waiting = 0
+        self._condition = threading.Condition()
+
+    def _roll_windows(self, now):
+        if now >= self._short_reset:
+            self.short_usage = 0
+            self._short_reset = _next_quarter_hour(now)
+        if now >= self._daily_reset:
+            self.daily_usage = 0
+            self._daily_reset = _next_midnight(now)
+
+    def _wait_time(self, priority, now):
+        """Сколько секунд ждать до разрешения запроса (0 — можно сейчас)."""
+        reserve = 0 if priority == INTERACTIVE else self.interactive_reserve
+
+        if self.daily_usage >= self.daily_limit - reserve:
+            return (self._daily_reset - now).total_seconds()
+        if self.short_usage >= self.short_limit - reserve:
+            return (self._short_reset - now).total_seconds()
+
+        if priority == BATCH:
+            # Интерактивные запросы, ждущие квоту, обслуживаются первыми
+            if self._interactive_waiting:
+                return 0.1
+            return max(0.0, self._next_batch_slot - time.monotonic())
+        return 0.0
+
+    def acquire(self, priority=INTERACTIVE):
+        """Блокирует поток, пока запрос не укладывается в квоту; затем резервирует его."""
+        with self._condition:
+            if priority == INTERACTIVE:
+                self._interactive_waiting += 1
+            try:
+                while True:
+                    now = datetime.utcnow()
+                    self._roll_windows(now)
+                    wait = self._wait_time(priority, now)
+                    if wait <= 0:
+                        break
+                    # Интерактивные запросы долго не ждут, а суточную квоту не ждёт никто
+                    max_wait = self.interactive_max_wait if priority == INTERACTIVE else SHORT_WINDOW_SECONDS
+                    if wait > max_wait:
+                        raise StravaRateLimitExceeded(
+                            f"Квота Strava исчерпана, восстановится через {int(wait)} с."
+                        )
+                    logging.info(f"Strava rate limit: {priority}-запрос ждёт {wait:.1f} с.")
+                    self._condition.wait(timeout=wait)
+            finally:
+                if priority == INTERACTIVE:
+                    self._interactive_waiting -= 1
+
+            self.short_usage += 1
+            self.daily_usage += 1
+
+            if priority == BATCH and self.short_usage >= self.short_limit // 2:
+                # Больше половины окна израсходовано: равномерно распределяем остаток пакетной квоты
+                remaining = max(1, self.short_limit - self.interactive_reserve - self.short_usage)
+                window_left = (self._short_reset - datetime.utcnow()).total_seconds()
+                self._next_batch_slot = time.monotonic() + max(0.0, window_left) / remaining
+
+    def update_from_headers(self, headers):
+        """Синхронизирует счётчики с заголовками X-RateLimit-Limit / X-RateLimit-Usage ответа Strava."""
+        limit = headers.get('X-RateLimit-Limit')
+        usage = headers.get('X-RateLimit-Usage')
+        if not limit or not usage:
+            return
+
+        try:
+            short_limit, daily_limit = (int(value) for value in limit.split(','))
+            short_usage, daily_usage = (int(value) for value in usage.split(','))
+        except ValueError:
+            logging.warning(f"Некорректные заголовки квоты Strava: {limit!r}, {usage!r}")
+            return
+
+        with self._condition:
+            self._roll_windows(datetime.utcnow())
+            self.short_limit, self.daily_limit = short_limit, daily_limit
+            self.short_usage, self.daily_usage = short_usage, daily_usage
+            self._condition.notify_all()
+
+    def mark_exhausted(self):
+        """Strava ответила 429: считаем 15-минутное окно исчерпанным до его сброса."""
+        with self._condition:
+            self.short_usage = max(self.short_usage, self.short_limit)
+
+    def remaining(self):
+        """Остаток квоты для мониторинга."""
+        with self._condition:
+            now = datetime.utcnow()
+            self._roll_windows(now)
+            return {
+                'short_limit': self.short_limit,
+                'short_usage': self.short_usage,
+                'short_remaining': max(0, self.short_limit - self.short_usage),
+                'short_reset_in': int((self._short_reset - now).total_seconds()),
+                'daily_limit': self.daily_limit,
+                'daily_usage': self.daily_usage,
+                'daily_remaining': max(0, self.daily_limit - self.daily_usage),
+                'daily_reset_in': int((self._daily_reset - now).total_seconds())
+            }
+
+
+rate_limiter = StravaRateLimiter(
+    short_limit=app.config['STRAVA_RATE_LIMIT_SHORT'],
+    daily_limit=app.config['STRAVA_RATE_LIMIT_DAILY'],
+    interactive_reserve=app.config['STRAVA_INTERACTIVE_RESERVE'],
+    interactive_max_wait=app.config['STRAVA_INTERACTIVE_MAX_WAIT']
+)
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+import threading
+import logging
+
+from kod import db
+from kod.models import Strava
+from kod.strava_ratelimit import StravaError
+
+
+class StravaTokenManager:
+    """
+    Токены доступа Strava с кэшем по пользователю.
+    Токен обновляется заранее — за refresh_margin секунд до token_expires_at, — и для каждого
+    пользователя одновременно идёт не больше одного обновления: остальные вызовы ждут его
+    и получают уже новый токен. Между процессами обновление сериализуется блокировкой строки (FOR UPDATE).
+    """
+
+    def __init__(self, client, refresh_margin):
+        self.client = client
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self._tokens = {}  # user_id -> (access_token, expires_at)
+        self._user_locks = {}
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, expires_at):
+        return expires_at is not None and expires_at - self.refresh_margin > datetime.utcnow()
+
+    def _cached(self, user_id):
+        cached = self._tokens.get(user_id)
+        if cached and self._is_fresh(cached[1]):
+            return cached[0]
+        return None
+
+    def _user_lock(self, user_id):
+        with self._lock:
+            return self._user_locks.setdefault(user_id, threading.Lock())
+
+    def get_token(self, user_id, strava_data=None):
+        """
+        Действующий токен доступа пользователя или None, если Strava не подключена или обновить токен не удалось.
+        strava_data — уже загруженная строка Strava, чтобы не запрашивать её повторно.
+        """
+        access_token = self._cached(user_id)
+        if access_token:
+            return access_token
+
+        if strava_data is not None and strava_data.access_token and self._is_fresh(strava_data.token_expires_at):
+            self.store(user_id, strava_data.access_token, strava_data.token_expires_at)
+            return strava_data.access_token
+
+        with self._user_lock(user_id):
+            # Пока ждали блокировку, токен мог обновить другой поток
+            access_token = self._cached(user_id)
+            if access_token:
+                return access_token
+            return self._refresh(user_id)
+
+    def _refresh(self, user_id):
+        strava_data = Strava.query.filter_by(user_id=user_id).with_for_update().populate_existing().first()
+        if not strava_data or not strava_data.access_token:
+            db.session.commit()
+            logging.warning(f"Нет данных Strava для пользователя {user_id}.")
+            return None
+
+        # Токен мог обновить другой процесс
+        if self._is_fresh(strava_data.token_expires_at):
+            db.session.commit()
+            self.store(user_id, strava_data.access_token, strava_data.token_expires_at)
+            return strava_data.access_token
+
+        if not strava_data.refresh_token:
+            db.session.commit()
+            logging.error(f"Не удалось найти refresh_token для пользователя {user_id}.")
+            return None
+
+        try:
+            token_data = self.client.refresh_token(strava_data.refresh_token)
+        except StravaError as e:
+            db.session.rollback()
+            logging.error(f"Ошибка при обновлении токена для пользователя {user_id}: {e}")
+            return None
+
+        strava_data.access_token = token_data['access_token']
+        strava_data.refresh_token = token_data['refresh_token']
+        strava_data.token_expires_at = datetime.utcfromtimestamp(token_data['expires_at'])
+        db.session.commit()
+        self.store(user_id, strava_data.access_token, strava_data.token_expires_at)
+        logging.info(f"Токен обновлён для пользователя {user_id}.")
+        return strava_data.access_token
+
+    def store(self, user_id, access_token, expires_at):
+        """Кладёт токен в кэш (после авторизации или обновления)."""
+        with self._lock:
+            self._tokens[user_id] = (access_token, expires_at)
+
+    def invalidate(self, user_id):
+        """Забывает токен пользователя, например после ответа 401."""
+        with self._lock:
+            self._tokens.pop(user_id, None)
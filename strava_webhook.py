@@ -0,0 +1,159 @@
+from flask import request, jsonify
+import logging
+import time
+
+import click
+
+from kod import app, db
+from kod.models import Track, Strava
+from kod.background import submit_job, get_job, executor
+from kod.strava import strava_client, token_manager, ingest_activities, activity_to_track_row
+from kod.strava_client import StravaHTTPError
+from kod.strava_ratelimit import BATCH
+from kod.track_points import delete_track_points
+from kod.challenges import invalidate_daily_distances
+
+
+def find_strava_user(owner_id):
+    """Пользователь приложения по id спортсмена Strava (owner_id события) или None."""
+    strava_data = Strava.query.filter_by(strava_url=f"https://www.strava.com/athletes/{owner_id}").first()
+    return strava_data.user_id if strava_data else None
+
+
+@app.route('/strava/webhook', methods=['GET'])
+def strava_webhook_validate():
+    """Подтверждение подписки: Strava присылает hub.challenge, который нужно вернуть."""
+    if request.args.get('hub.mode') != 'subscribe':
+        return jsonify({'error': 'Unsupported hub.mode'}), 400
+    verify_token = app.config['STRAVA_WEBHOOK_VERIFY_TOKEN']
+    if not verify_token or request.args.get('hub.verify_token') != verify_token:
+        logging.warning("Подписка на события Strava: неверный verify_token.")
+        return jsonify({'error': 'Invalid verify token'}), 403
+
+    return jsonify({'hub.challenge': request.args.get('hub.challenge')}), 200
+
+
+@app.route('/strava/webhook', methods=['POST'])
+def strava_webhook_event():
+    """
+    Событие подписки Strava. Отвечаем сразу (Strava ждёт ответ не дольше 2 секунд),
+    а загрузку или удаление активности ставим в фоновую очередь.
+    """
+    event = request.get_json(silent=True) or {}
+
+    # Без id подписки нельзя отличить событие Strava от подделанного запроса
+    subscription_id = app.config['STRAVA_WEBHOOK_SUBSCRIPTION_ID']
+    if subscription_id is None:
+        logging.warning("Событие Strava отклонено: STRAVA_WEBHOOK_SUBSCRIPTION_ID не задан.")
+        return jsonify({'error': 'Webhook subscription is not configured'}), 403
+    if event.get('subscription_id') != subscription_id:
+        logging.warning(f"Событие Strava от чужой подписки: {event.get('subscription_id')}")
+        return jsonify({'status': 'ignored'}), 200
+
+    if event.get('object_type') != 'activity':
+        logging.info(f"Событие Strava {event.get('object_type')}/{event.get('aspect_type')} пропущено.")
+        return jsonify({'status': 'ignored'}), 200
+
+    user_id = find_strava_user(event.get('owner_id'))
+    if not user_id:
+        logging.info(f"Событие Strava для неизвестного спортсмена {event.get('owner_id')} пропущено.")
+        return jsonify({'status': 'ignored'}), 200
+
+    activity_id = event.get('object_id')
+    aspect_type = event.get('aspect_type')
+    if aspect_type in ('create', 'update'):
+        job_id = submit_job('strava_webhook', fetch_activity, user_id, activity_id, owner_id=user_id)
+    elif aspect_type == 'delete':
+        job_id = submit_job('strava_webhook', delete_activity, user_id, activity_id, owner_id=user_id)
+    else:
+        return jsonify({'status': 'ignored'}), 200
+
+    logging.info(f"Событие Strava {aspect_type} активности {activity_id} пользователя {user_id}: задача {job_id}.")
+    return jsonify({'status': 'queued', 'job_id': job_id}), 200
+
+
+def fetch_activity(user_id, activity_id):
+    """Загружает одну активность из Strava и добавляет трек или обновляет существующий."""
+    access_token = token_manager.get_token(user_id)
+    if not access_token:
+        return {'user_id': user_id, 'activity_id': activity_id, 'status': 'skipped'}
+
+    activity = strava_client.get_activity(access_token, activity_id, BATCH)
+
+    track = Track.query.filter_by(filename=str(activity_id), user_id=user_id).first()
+    if not track:
+        report = ingest_activities(user_id, [activity])
+        status = 'error' if report['errors'] else 'ok'
+        return {'user_id': user_id, 'activity_id': activity_id, 'status': status, 'new_tracks': report['inserted']}
+
+    # Активность изменена в Strava: переносим новые данные, время загрузки оставляем прежним
+    row = activity_to_track_row(user_id, activity)
+    row.pop('upload_time')
+    for field, value in row.items():
+        setattr(track, field, value)
+    db.session.commit()
+    invalidate_daily_distances([user_id])
+    logging.info(f"Трек {track.id} обновлён по событию Strava.")
+    return {'user_id': user_id, 'activity_id': activity_id, 'status': 'ok', 'new_tracks': 0}
+
+
+def activity_is_deleted(user_id, activity_id):
+    """Проверяет в Strava, что активности больше нет: событие само по себе не доказывает удаление."""
+    access_token = token_manager.get_token(user_id)
+    if not access_token:
+        return False
+    try:
+        strava_client.get_activity(access_token, activity_id, BATCH)
+    except StravaHTTPError as e:
+        return e.status_code == 404
+    return False
+
+
+def delete_activity(user_id, activity_id):
+    """Удаляет трек, соответствующий удалённой в Strava активности."""
+    track = Track.query.filter_by(filename=str(activity_id), user_id=user_id).first()
+    if not track:
+        return {'user_id': user_id, 'activity_id': activity_id, 'status': 'skipped'}
+
+    if not activity_is_deleted(user_id, activity_id):
+        logging.warning(f"Активность {activity_id} пользователя {user_id} есть в Strava; трек не удалён.")
+        return {'user_id': user_id, 'activity_id': activity_id, 'status': 'skipped'}
+
+    track_id = track.id
+    db.session.delete(track)
+    db.session.commit()
+    delete_track_points(track_id)
+    invalidate_daily_distances([user_id])
+    logging.info(f"Трек {track_id} удалён по событию Strava.")
+    return {'user_id': user_id, 'activity_id': activity_id, 'status': 'deleted'}
+
+
+@app.cli.command('strava-emit-event')
+@click.argument('aspect_type', type=click.Choice(['create', 'update', 'delete']))
+@click.argument('activity_id', type=int)
+@click.argument('owner_id', type=int)
+def emit_strava_event(aspect_type, activity_id, owner_id):
+    """
+    Локальная замена Strava для отладки подписки без публичного адреса: отправляет событие
+    активности на /strava/webhook через тестовый клиент и ждёт завершения фоновой задачи.
+    Нужен STRAVA_WEBHOOK_SUBSCRIPTION_ID: без него события отклоняются.
+    Пример: flask --app kod strava-emit-event create 123456789 987654
+    """
+    event = {
+        'object_type': 'activity',
+        'object_id': activity_id,
+        'aspect_type': aspect_type,
+        'owner_id': owner_id,
+        'subscription_id': app.config['STRAVA_WEBHOOK_SUBSCRIPTION_ID'],
+        'event_time': int(time.time()),
+        'updates': {}
+    }
+
+    response = app.test_client().post('/strava/webhook', json=event)
+    payload = response.get_json()
+    click.echo(f"{response.status_code} {payload}")
+
+    executor.shutdown(wait=True)
+    job = get_job(payload.get('job_id'))
+    if job:
+        click.echo(f"{job['status']}: {job['result'] or job['error']}")
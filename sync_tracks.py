@@ -1,13 +1,25 @@
 import logging
-from flask import redirect, url_for, flash
-from kod import app
+import threading
+import json
+import time
+from flask import redirect, url_for, flash, jsonify, Response, stream_with_context
+from flask_login import current_user
+from kod import app, db
 from kod.models import Strava
-from kod.strava import get_activities, save_tracks_to_db, refresh_access_token
-from datetime import datetime
+from kod.strava import get_activities, ingest_activities, token_manager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
 
 from kod.admin import admin_required
-from kod.strava import update_strava_sync_time
+from kod.strava import update_strava_sync_time, get_sync_cursor, strava_client, update_strava_url_in_db
+from kod.strava_ratelimit import BATCH, INTERACTIVE, rate_limiter
+from kod.background import submit_job, get_job, latest_job, is_active, cancel_job, update_job_progress, is_cancel_requested
+
+# Как часто (в секундах) поток SSE проверяет прогресс синхронизации
+SSE_INTERVAL = 1.0
+# Сколько секунд держать один поток SSE: потом EventSource переподключается сам,
+# и запрос не занимает воркер gunicorn дольше его таймаута
+SSE_MAX_DURATION = 25
 
 # Путь к подпапке для логов
 log_dir = 'logs'
@@ -23,72 +35,252 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-def sync_tracks():
+def _prepare_user(user):
+    """Проверяет данные Strava пользователя и при необходимости обновляет токен. Возвращает токен или None."""
+    # Проверка на отсутствие данных Strava
+    if not user.access_token or not user.refresh_token:
+        logging.warning(f"Нет данных Strava для пользователя {user.user_id}. Пропускаем.")
+        return None
+
+    # Токен берётся из кэша или обновляется заранее, до истечения
+    access_token = token_manager.get_token(user.user_id, user)
+    if not access_token:
+        logging.error(f"Ошибка обновления токена для пользователя {user.user_id}")
+    return access_token
+
+
+def sync_user(user_id, priority=INTERACTIVE):
+    """
+    Синхронизирует одного пользователя: при необходимости обновляет токен и ссылку на профиль,
+    затем инкрементально забирает активности и сохраняет новые треки.
+    """
+    strava_data = Strava.query.filter_by(user_id=user_id).first()
+    access_token = _prepare_user(strava_data) if strava_data else None
+    if not access_token:
+        return {'user_id': user_id, 'status': 'skipped', 'new_tracks': 0}
+
+    # Профиль спортсмена нужен только для ссылки — запрашиваем его, пока ссылки нет
+    if not strava_data.strava_url:
+        athlete_id = strava_client.get_athlete(access_token, priority).get('id')
+        if athlete_id:
+            update_strava_url_in_db(user_id, f"https://www.strava.com/athletes/{athlete_id}")
+
+    report = {'inserted': 0, 'skipped': 0, 'errors': 0}
+    activities = get_activities(access_token, priority, get_sync_cursor(strava_data))
+    if activities:
+        report = ingest_activities(user_id, activities)
+
+    logging.info(f"Добавлено {report['inserted']} новых треков для пользователя {user_id}")
+    return _finish_user_sync(user_id, report)
+
+
+def _finish_user_sync(user_id, report):
+    """
+    Итог синхронизации пользователя. Время синхронизации сдвигается, только если все активности
+    записаны: иначе следующая инкрементальная синхронизация пропустила бы незаписанные.
+    """
+    result = {
+        'user_id': user_id,
+        'status': 'ok',
+        'new_tracks': report['inserted'],
+        'skipped_tracks': report['skipped']
+    }
+    if report.get('errors'):
+        logging.error(f"Не записано {report['errors']} активностей пользователя {user_id}; время синхронизации не обновлено.")
+        result['status'] = 'error'
+        result['error'] = f"Не удалось сохранить {report['errors']} активностей"
+        return result
+
+    update_strava_sync_time(user_id)
+    return result
+
+
+def _fetch_user_activities(user_id):
+    """
+    Задача пула sync_all_users: токен пользователя (при необходимости обновлённый) и его новые активности.
+    Работает в своём контексте приложения со своей сессией. Возвращает (False, None), если у пользователя
+    нет действующего токена, иначе (True, активности).
+    """
     with app.app_context():
-        users = Strava.query.all()  # Получаем всех пользователей
-        for user in users:
-            logging.info(f"Начинаем синхронизацию для пользователя {user.user_id}")
-
-            # Проверка на отсутствие данных Strava
-            if not user.access_token or not user.refresh_token:
-                logging.warning(f"Нет данных Strava для пользователя {user.user_id}. Пропускаем.")
-                continue  # Пропускаем пользователей без данных Strava
-
-            # Проверяем, истек ли токен
-            if user.token_expires_at and user.token_expires_at < datetime.utcnow():
-                new_token = refresh_access_token(user.user_id)  # Обновляем токен
-                if not new_token:
-                    logging.error(f"Ошибка обновления токена для пользователя {user.user_id}")
-                    continue
-
-            access_token = user.access_token
-            activities = get_activities(access_token)
+        try:
+            logging.info(f"Начинаем синхронизацию для пользователя {user_id}")
+            strava_data = Strava.query.filter_by(user_id=user_id).first()
+            access_token = _prepare_user(strava_data) if strava_data else None
+            if not access_token:
+                return False, None
+            # Инкрементально: только новое с прошлой синхронизации
+            return True, get_activities(access_token, BATCH, get_sync_cursor(strava_data))
+        finally:
+            db.session.remove()
+
+
+def sync_all_users(progress=None, cancelled=None, user_ids=None):
+    """
+    Синхронизирует треки всех пользователей Strava (или только пользователей из user_ids).
+    Токены (с обновлением по OAuth) и активности запрашиваются параллельно (пул из STRAVA_SYNC_WORKERS
+    потоков), а треки в базу записывает только текущий поток — по мере готовности ответов.
+    Возвращает результат по каждому пользователю.
+    progress(result, total) вызывается после каждого пользователя; если cancelled() вернёт True,
+    оставшиеся пользователи пропускаются.
+    """
+    query = db.session.query(Strava.user_id)
+    if user_ids is not None:
+        query = query.filter(Strava.user_id.in_(list(user_ids)))
+    users = [user_id for (user_id,) in query]  # Получаем всех пользователей
+    total = len(users)
+    results = []
+
+    def report(result):
+        results.append(result)
+        if progress:
+            progress(result, total)
+
+    pool = ThreadPoolExecutor(max_workers=app.config['STRAVA_SYNC_WORKERS'])
+    try:
+        futures = {pool.submit(_fetch_user_activities, user_id): user_id for user_id in users}
+
+        for future in as_completed(futures):
+            if cancelled and cancelled():
+                logging.info("Синхронизация со Strava отменена.")
+                break
+
+            user_id = futures[future]
+            try:
+                prepared, activities = future.result()
+            except Exception as e:
+                logging.error(f"Ошибка получения активностей для пользователя {user_id}: {e}")
+                report({'user_id': user_id, 'status': 'error', 'new_tracks': 0, 'error': str(e)})
+                continue
+            if not prepared:
+                report({'user_id': user_id, 'status': 'skipped', 'new_tracks': 0})
+                continue
+
+            result = {'inserted': 0, 'skipped': 0, 'errors': 0}
             if activities:
-                new_tracks_count = save_tracks_to_db(user.user_id, activities)
-                logging.info(f"Добавлено {new_tracks_count} новых треков для пользователя {user.user_id}")
+                result = ingest_activities(user_id, activities)
+                logging.info(f"Добавлено {result['inserted']} новых треков для пользователя {user_id}")
             else:
-                logging.info(f"Нет новых активностей для пользователя {user.user_id}")
+                logging.info(f"Нет новых активностей для пользователя {user_id}")
+
+            # Обновляем время последней синхронизации, если всё записано
+            report(_finish_user_sync(user_id, result))
+    finally:
+        # При отмене не ждём запросов, ожидающих квоту: их результаты уже не нужны
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    return results
+
+
+def sync_tracks():
+    with app.app_context():
+        return sync_all_users()
+
+
+# Не даёт двум запросам этого процесса одновременно запустить синхронизацию
+_admin_sync_lock = threading.Lock()
+
+
+def run_admin_sync():
+    """
+    Фоновая синхронизация всех пользователей; прогресс сохраняется в задаче после каждого пользователя.
+    Остаток квоты тоже пишется в прогресс: ограничитель в памяти процесса, и верен он только здесь,
+    а не в воркере, который отвечает на опрос страницы администратора.
+    """
+    progress = {'users_total': 0, 'users_done': 0, 'tracks_added': 0, 'errors': [], 'rate_limit': rate_limiter.remaining()}
+    update_job_progress(progress)
+
+    def on_result(result, total):
+        progress['users_total'] = total
+        progress['users_done'] += 1
+        progress['tracks_added'] += result['new_tracks']
+        if result['status'] == 'error':
+            progress['errors'].append({'user_id': result['user_id'], 'error': result['error']})
+        progress['rate_limit'] = rate_limiter.remaining()
+        update_job_progress(progress)
+
+    return sync_all_users(progress=on_result, cancelled=is_cancel_requested)
+
+
+def admin_sync_snapshot(job):
+    """Состояние синхронизации для страницы администратора."""
+    progress = job['progress'] or {}
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'users_total': progress.get('users_total', 0),
+        'users_done': progress.get('users_done', 0),
+        'tracks_added': progress.get('tracks_added', 0),
+        'errors': list(progress.get('errors', [])),
+        'error': job['error'],
+        'rate_limit': progress.get('rate_limit')
+    }
+
 
 @app.route('/sync_strava', methods=['GET'])
 @admin_required  # Добавьте проверку на админские права
 def sync_strava():
-    try:
-        flash("Синхронизация с Strava началась...", "info")
-        # Начинаем синхронизацию
-        with app.app_context():
-            users = Strava.query.all()  # Получаем всех пользователей
-            total_users = len(users)
-            total_tracks = 0
-
-            for user in users:
-                logging.info(f"Начинаем синхронизацию для пользователя {user.user_id}")
-
-                if not user.access_token or not user.refresh_token:
-                    logging.warning(f"Нет данных Strava для пользователя {user.user_id}. Пропускаем.")
-                    continue  # Пропускаем пользователей без данных Strava
-
-                if user.token_expires_at and user.token_expires_at < datetime.utcnow():
-                    new_token = refresh_access_token(user.user_id)
-                    if not new_token:
-                        logging.error(f"Ошибка обновления токена для пользователя {user.user_id}")
-                        continue
-
-                access_token = user.access_token
-                activities = get_activities(access_token)
-                if activities:
-                    new_tracks_count = save_tracks_to_db(user.user_id, activities)
-                    total_tracks += new_tracks_count
-                    logging.info(f"Добавлено {new_tracks_count} новых треков для пользователя {user.user_id}")
-                    
-                    # Обновляем время последней синхронизации
-                    update_strava_sync_time(user.user_id)
-
-                else:
-                    logging.info(f"Нет новых активностей для пользователя {user.user_id}")
-
-            flash(f"Синхронизация завершена: {total_users} пользователей и {total_tracks} треков синхронизировано.", "success")
-
-    except Exception as e:
-        flash(f'Произошла ошибка при синхронизации: {str(e)}', 'danger')
+    """Запускает синхронизацию всех пользователей в фоне (не больше одной одновременно)."""
+    with _admin_sync_lock:
+        if is_active(latest_job('strava_sync')):
+            flash("Синхронизация с Strava уже идёт.", "info")
+        else:
+            submit_job('strava_sync', run_admin_sync, owner_id=current_user.id)
+            flash("Синхронизация с Strava началась...", "info")
 
     return redirect(url_for('admin_dashboard'))  # Перенаправляем на админскую страницу
+
+
+@app.route('/sync_strava/progress')
+@admin_required
+def sync_strava_progress():
+    """Текущее состояние синхронизации (JSON)."""
+    job = latest_job('strava_sync')
+    if not job:
+        return jsonify({'status': 'idle', 'rate_limit': rate_limiter.remaining()})
+    return jsonify(admin_sync_snapshot(job))
+
+
+@app.route('/sync_strava/stream')
+@admin_required
+def sync_strava_stream():
+    """
+    Прогресс синхронизации в реальном времени (Server-Sent Events). Поток закрывается через
+    SSE_MAX_DURATION секунд, браузер переподключается через retry и продолжает с текущего состояния.
+    """
+    job = latest_job('strava_sync')
+    if not job:
+        return jsonify({'status': 'idle'}), 404
+    job_id = job['id']
+
+    def events():
+        last = None
+        deadline = time.monotonic() + SSE_MAX_DURATION
+        yield f"retry: {int(SSE_INTERVAL * 1000)}\n\n"
+        while time.monotonic() < deadline:
+            job = get_job(job_id)
+            if not job:
+                return
+            snapshot = admin_sync_snapshot(job)
+            if snapshot != last:
+                yield f"data: {json.dumps(snapshot)}\n\n"
+                last = snapshot
+            if snapshot['status'] not in ('queued', 'running'):
+                yield "event: end\ndata: {}\n\n"
+                return
+            time.sleep(SSE_INTERVAL)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}  # nginx не должен буферизовать поток
+    )
+
+
+@app.route('/sync_strava/cancel', methods=['POST'])
+@admin_required
+def sync_strava_cancel():
+    """Отмена текущей синхронизации."""
+    job = latest_job('strava_sync')
+    if not job or not cancel_job(job['id']):
+        return jsonify({'error': 'Синхронизация не выполняется'}), 409
+    return jsonify({'status': 'cancelling'}), 202
@@ -0,0 +1,68 @@
+"""
+Паритет точного расчёта дистанции (distance.ellipsoid_segments) с geopy.distance.geodesic.
+
+Корпус — реальные GPX-файлы клуба в tests/fixtures/gpx (или в папке из KOD_GPX_CORPUS);
+без корпуса тест на файлах пропускается.
+"""
+import importlib.util
+import glob
+import os
+
+import numpy as np
+import pytest
+
+geopy_distance = pytest.importorskip('geopy.distance')
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS_DIR = os.getenv('KOD_GPX_CORPUS', os.path.join(PACKAGE_DIR, 'tests', 'fixtures', 'gpx'))
+
+# Допуск: миллиметр на отрезок и миллионная доля на весь трек
+SEGMENT_TOLERANCE_KM = 1e-6
+TRACK_RELATIVE_TOLERANCE = 1e-6
+
+
+def _load(name):
+    """Модули расчёта загружаются напрямую из файлов, без инициализации приложения kod."""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(PACKAGE_DIR, f'{name}.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+distance = _load('distance')
+gpx_parser = _load('gpx_parser')
+
+CORPUS = sorted(glob.glob(os.path.join(CORPUS_DIR, '*.gpx')))
+
+
+def geopy_segments(lats, lons):
+    return np.array([
+        geopy_distance.geodesic((lats[i], lons[i]), (lats[i + 1], lons[i + 1])).km
+        for i in range(len(lats) - 1)
+    ])
+
+
+def assert_parity(lats, lons):
+    expected = geopy_segments(lats, lons)
+    actual = distance.segment_distances(lats, lons, 'ellipsoid')
+
+    np.testing.assert_allclose(actual, expected, rtol=0, atol=SEGMENT_TOLERANCE_KM)
+    assert actual.sum() == pytest.approx(expected.sum(), rel=TRACK_RELATIVE_TOLERANCE, abs=SEGMENT_TOLERANCE_KM)
+
+
+def test_parity_on_synthetic_points():
+    rng = np.random.default_rng(0)
+    lats = np.concatenate([rng.uniform(51, 56, 200), [0.0, 0.5, 89.9, -89.9]])
+    lons = np.concatenate([rng.uniform(23, 33, 200), [0.0, 179.5, 10.0, -170.0]])
+    assert_parity(lats, lons)
+
+
+@pytest.mark.skipif(not CORPUS, reason=f'нет GPX-корпуса в {CORPUS_DIR}')
+@pytest.mark.parametrize('path', CORPUS, ids=os.path.basename)
+def test_parity_on_club_tracks(path):
+    with open(path, 'rb') as source:
+        points = list(gpx_parser.iter_trackpoints(source))
+    if len(points) < 2:
+        pytest.skip('в треке меньше двух точек')
+
+    assert_parity([point['lat'] for point in points], [point['lon'] for point in points])
@@ -0,0 +1,62 @@
+import re
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Форматы времени трекпунктов, которые мы принимаем (в порядке проверки)
+TIME_FORMATS = ("%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ", "%Y-%m-%dT%H:%M:%S")
+
+# Регулярные выражения для тех же форматов: ими проверяется весь файл перед пакетным разбором
+TIME_PATTERNS = {
+    "%Y-%m-%dT%H:%M:%S.%fZ": re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{1,6}Z'),
+    "%Y-%m-%dT%H:%M:%SZ": re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z'),
+    "%Y-%m-%dT%H:%M:%S": re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}'),
+}
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def parse_time(time_string):
+    """Попробуйте разобрать строку времени в нескольких форматах."""
+    for fmt in TIME_FORMATS:
+        try:
+            return datetime.strptime(time_string, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Не удалось разобрать время: {time_string}")
+
+
+def detect_time_format(time_string):
+    """Определяет формат времени по одной строке (обычно по первой точке файла)."""
+    for fmt in TIME_FORMATS:
+        if TIME_PATTERNS[fmt].fullmatch(time_string):
+            return fmt
+    return None
+
+
+def decode_times(time_strings):
+    """
+    Пакетный разбор времени всех трекпунктов в массив секунд от эпохи (float64).
+    Формат определяется один раз по первой строке; если весь файл ему соответствует,
+    строки разбираются одним вызовом NumPy, иначе — построчно через parse_time.
+    """
+    if not time_strings:
+        return np.zeros(0)
+
+    fmt = detect_time_format(time_strings[0])
+    pattern = TIME_PATTERNS.get(fmt)
+
+    if pattern is not None and all(map(pattern.fullmatch, time_strings)):
+        if fmt.endswith('Z'):
+            time_strings = [time_string[:-1] for time_string in time_strings]
+        stamps = np.array(time_strings, dtype='datetime64[us]')
+    else:
+        # Смешанные форматы в одном файле — медленный, но совместимый путь
+        stamps = np.array([parse_time(time_string) for time_string in time_strings], dtype='datetime64[us]')
+
+    return stamps.astype(np.int64) / 1e6
+
+
+def epoch_to_datetime(seconds):
+    """Переводит секунды от эпохи обратно в наивный datetime (UTC, как в GPX)."""
+    return EPOCH + timedelta(microseconds=round(float(seconds) * 1e6))
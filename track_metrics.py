@@ -0,0 +1,102 @@
+import hashlib
+import logging
+
+import numpy as np
+
+from kod.distance import track_distance
+from kod.timestamps import decode_times, epoch_to_datetime
+
+PAUSE_THRESHOLD = 5  # порог паузы в секундах для чистого времени
+
+
+class TrackMetrics:
+    """
+    Накопитель метрик трека за один проход по точкам.
+    Каждая точка добавляется один раз через add(): набор высоты и хеш содержимого считаются по ходу,
+    координаты и строки времени копятся, а в finish() время всех точек разбирается
+    одним пакетом, после чего дистанция, общее и чистое время считаются над массивами.
+    """
+
+    def __init__(self, distance_method='ellipsoid', pause_threshold=PAUSE_THRESHOLD):
+        self.distance_method = distance_method
+        self.pause_threshold = pause_threshold
+
+        self.lats = []
+        self.lons = []
+        self.eles = []
+        self.times = []
+        self.epoch_seconds = None
+
+        self.elevation_gain = 0.0
+        self._previous_elevation = None
+
+        self._digest = hashlib.sha256()
+
+    def __len__(self):
+        return len(self.times)
+
+    def add(self, point):
+        """Добавляет трекпункт (словарь lat/lon/ele/time). Точки без времени пропускаются."""
+        if not point.get('time'):
+            return False
+
+        self.lats.append(float(point['lat']))
+        self.lons.append(float(point['lon']))
+        self.times.append(point['time'])
+
+        # Если есть значение высоты, вычисляем набор высоты
+        ele = point.get('ele')
+        elevation = float('nan')
+        if ele:
+            try:
+                elevation = float(ele)
+                if self._previous_elevation is not None and elevation > self._previous_elevation:
+                    self.elevation_gain += elevation - self._previous_elevation
+                self._previous_elevation = elevation
+            except ValueError:
+                logging.warning(f'Invalid elevation value: {ele}')
+        self.eles.append(elevation)
+
+        # Хеш нормализованных точек: одинаковый трек даёт одинаковый хеш независимо от имени и форматирования файла
+        self._digest.update(
+            f"{self.lats[-1]:.6f},{self.lons[-1]:.6f},{elevation:.1f},{point['time'].strip().rstrip('Z')}\n".encode()
+        )
+
+        return True
+
+    @property
+    def content_hash(self):
+        """SHA-256 нормализованных точек трека (hex)."""
+        return self._digest.hexdigest()
+
+    def _net_duration_seconds(self, epoch_seconds):
+        # Чистое время считаем по точкам, отсортированным по времени
+        time_diffs = np.diff(epoch_seconds)
+        if (time_diffs < 0).any():
+            time_diffs = np.diff(np.sort(epoch_seconds))
+        return float(time_diffs[time_diffs <= self.pause_threshold].sum())
+
+    def finish(self):
+        """Итоговые метрики трека."""
+        if not self.times:
+            return None
+
+        epoch_seconds = self.epoch_seconds = decode_times(self.times)
+
+        return {
+            'points': len(self.times),
+            'distance': track_distance(self.lats, self.lons, self.distance_method),
+            'elevation_gain': self.elevation_gain,
+            'duration': float(epoch_seconds[-1] - epoch_seconds[0]),
+            'net_duration': self._net_duration_seconds(epoch_seconds),
+            'record_time': epoch_to_datetime(epoch_seconds[0]),
+            'content_hash': self.content_hash
+        }
+
+
+def calculate_track_metrics(points, distance_method='ellipsoid'):
+    """Считает метрики для любой последовательности трекпунктов за один проход."""
+    metrics = TrackMetrics(distance_method)
+    for point in points:
+        metrics.add(point)
+    return metrics.finish()
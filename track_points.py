@@ -0,0 +1,80 @@
+from flask import jsonify
+from flask_login import login_required, current_user
+import logging
+import os
+
+import numpy as np
+
+from kod import app
+from kod.models import Track
+
+# Колонки хранимых трекпунктов: широта, долгота, высота (NaN, если нет) и время в секундах от эпохи
+POINT_DTYPE = np.dtype([
+    ('lat', '<f8'),
+    ('lon', '<f8'),
+    ('ele', '<f4'),
+    ('time', '<f8')
+])
+
+
+def track_points_path(track_id):
+    """Путь к файлу с точками трека (один .npy на Track.id)."""
+    return os.path.join(app.config['TRACK_POINTS_FOLDER'], f'{track_id}.npy')
+
+
+def save_track_points(track_id, lats, lons, eles, times):
+    """Сохраняет точки трека в компактный колоночный файл .npy."""
+    points = np.empty(len(lats), dtype=POINT_DTYPE)
+    points['lat'] = lats
+    points['lon'] = lons
+    points['ele'] = eles
+    points['time'] = times
+
+    folder = app.config['TRACK_POINTS_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+
+    # Пишем во временный файл и подменяем, чтобы читатели не увидели недописанный файл
+    path = track_points_path(track_id)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, points)
+    os.replace(tmp_path, path)
+    logging.info(f"Сохранено {len(points)} точек трека {track_id}.")
+
+
+def load_track_points(track_id):
+    """Возвращает точки трека (отображение файла в память, только чтение) или None."""
+    path = track_points_path(track_id)
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode='r')
+
+
+def delete_track_points(track_id):
+    """Удаляет файл с точками трека, если он есть."""
+    try:
+        os.remove(track_points_path(track_id))
+    except FileNotFoundError:
+        pass
+
+
+@app.route('/track/<int:track_id>/points')
+@login_required
+def track_points(track_id):
+    """Геометрия трека из сохранённых точек, без повторного разбора GPX."""
+    track = Track.query.get_or_404(track_id)
+    if track.user_id != current_user.id and not current_user.is_admin:
+        return jsonify({'error': 'У вас нет прав на просмотр этого трека'}), 403
+
+    points = load_track_points(track_id)
+    if points is None:
+        return jsonify({'error': 'Точки трека не сохранены'}), 404
+
+    ele = points['ele'].astype(np.float64)
+    return jsonify({
+        'track_id': track_id,
+        'lat': points['lat'].tolist(),
+        'lon': points['lon'].tolist(),
+        'ele': np.where(np.isnan(ele), None, ele).tolist(),
+        'time': points['time'].tolist()
+    }), 200
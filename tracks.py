@@ -1,14 +1,30 @@
-from flask import request, session, jsonify
+from flask import request, session, jsonify, url_for
 from flask_login import login_required, current_user
 from lxml import etree
-from datetime import datetime, timedelta
-from geopy.distance import geodesic
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime
+import tempfile
+import hashlib
+import os
 
 from kod import app, db
 from kod.models import Track, User
+from kod.gpx_parser import iter_trackpoints
+from kod.track_metrics import TrackMetrics
+from kod.background import submit_job, get_job
+from kod.track_points import save_track_points
+from kod.polyline import simplified_polyline
+from kod.compression import detect_compression, strip_compression_suffix, open_gpx, DECOMPRESSION_ERRORS
+from kod.challenges import invalidate_daily_distances
 
 import logging
 
+DUPLICATE_TRACK_ERROR = 'Такі трэк ўжо быў запампаваны! Выберыце іншы!.'
+
+# Код ошибки MySQL «Duplicate entry» и уникальные колонки трека, по которым ищутся дубли
+MYSQL_DUPLICATE_ENTRY = 1062
+TRACK_UNIQUE_KEYS = ('filename', 'content_hash', 'file_hash')
+
 @app.route('/upload', methods=['POST'])
 @login_required
 def upload_file():
@@ -23,178 +39,208 @@ def upload_file():
         return jsonify({'error': 'No selected file'}), 400
 
     if file and allowed_file(file.filename):
-        try:
-            # Читаем содержимое файла
-            file_content = file.read()
-            print('File content read successfully')
-
-            # Парсинг GPX с использованием lxml
-            root = etree.fromstring(file_content)
-
-            # Определение пространства имен из файла
-            namespace = root.nsmap.get(None, '')
-            print(f'Namespace detected: {namespace}')
-
-            # Извлечение информации о треках
-            tracks = []
-            elevation_gain = 0.0
-            previous_elevation = None
-
-            for trk in root.xpath('//ns:trk', namespaces={'ns': namespace}):
-                name = trk.find('ns:name', namespaces={'ns': namespace}).text
-                print(f'Extracting track: {name}')
-
-                for trkseg in trk.xpath('ns:trkseg', namespaces={'ns': namespace}):
-                    for trkpt in trkseg.xpath('ns:trkpt', namespaces={'ns': namespace}):
-                        lat = trkpt.get('lat')
-                        lon = trkpt.get('lon')
-                        ele = trkpt.find('ns:ele', namespaces={'ns': namespace}).text
-                        time = trkpt.find('ns:time', namespaces={'ns': namespace}).text
-
-                        # Проверяем и добавляем данные в трек
-                        if time:
-                            tracks.append({
-                                'name': name,
-                                'lat': lat,
-                                'lon': lon,
-                                'ele': ele,
-                                'time': time
-                            })
-
-                            # Если есть значение высоты, вычисляем набор высоты
-                            if ele:
-                                try:
-                                    ele = float(ele)
-
-                                    if previous_elevation is not None and ele > previous_elevation:
-                                        elevation_gain += (ele - previous_elevation)
-
-                                    previous_elevation = ele
-                                except ValueError:
-                                    print(f'Invalid elevation value: {ele}')
-                                    continue  # Игнорируем некорректные значения
-                        else:
-                            print('Trackpoint without time found; skipping.')
-
-            # Логирование извлеченных треков
-            print(f'Total tracks extracted: {len(tracks)}')
-
-            if not tracks:
-                print('No tracks extracted from GPX file.')
-                return jsonify({'error': 'Не атрымалася загрузіць трэк.'}), 400
-
-            # Проверка на существование трека с таким же именем
-            existing_track = Track.query.filter_by(filename=file.filename).first()
-            if existing_track:
-                print(f'File with the same name already exists: {file.filename}')
-                return jsonify({'error': 'Такі трэк ўжо быў запампаваны! Выберыце іншы!.'}), 400
-
-            # Получаем user_id из текущего пользователя
-            user_id = current_user.id  # Берем ID текущего пользователя через Flask-Login
-
-            # Логика для записи в базу данных
-            duration_in_seconds = calculate_duration(tracks)  # Общее время
-            net_duration = calculate_net_duration(tracks)  # Чистое время
-            formatted_duration = format_duration(duration_in_seconds)
-            formatted_net_duration = format_duration(net_duration.total_seconds())
-
-            new_track = Track(
-                user_id=user_id,  # Записываем user_id
-                filename=file.filename,
-                name_track=file.filename,
-                distance=round(calculate_distance(tracks), 2),
-                duration=formatted_duration,
-                net_duration=formatted_net_duration,
-                upload_time=datetime.now(),
-                record_time=parse_time(tracks[0]['time']) if tracks[0]['time'] else None,
-                height=round(elevation_gain)
-            )
-
-            # Сохранение трека в базу данных
-            db.session.add(new_track)
-            db.session.commit()
-            print('Track saved to database successfully')
-
-            return jsonify({
-                'success': 'Трэк паспяхова запампаваны!',
-                'tracks': tracks,
-                'filename': file.filename,
-                'total_distance': round(calculate_distance(tracks), 2),
-                'duration': formatted_duration,
-                'net_duration': formatted_net_duration,
-                'height': round(elevation_gain)
-            }), 200
-
-        except etree.XMLSyntaxError as e:
-            print(f'XML parsing error: {str(e)}')
-            return jsonify({'error': f'Ошибка парсинга GPX: {str(e)}'}), 400
-        except Exception as e:
-            print(f'Unexpected error: {str(e)}')
-            return jsonify({'error': f'Произошла ошибка: {str(e)}'}), 500
+        # Сохраняем файл во временный (сжатый — как есть) и сразу отвечаем: разбор и запись трека идут в фоне
+        compression = detect_compression(file.filename)
+        fd, path = tempfile.mkstemp(suffix='.gpx', dir=app.config['UPLOAD_TMP_FOLDER'])
+        with os.fdopen(fd, 'wb') as tmp:
+            file_hash = copy_and_hash(file.stream, tmp)
+        filename = strip_compression_suffix(file.filename)
+
+        # Тот же файл (или файл с тем же именем) уже загружен: отвечаем сразу, без разбора
+        existing_track = Track.query.filter(
+            (Track.filename == filename) | (Track.file_hash == file_hash)
+        ).first()
+        if existing_track:
+            os.remove(path)
+            logging.info(f'Трек {filename} уже загружен (как {existing_track.filename}).')
+            return jsonify({'error': DUPLICATE_TRACK_ERROR}), 400
+
+        # По умолчанию в ответе упрощённая линия; полный список точек — только по ?points=full
+        full_points = request.values.get('points') == 'full'
+        tolerance = request.values.get('tolerance', app.config['POLYLINE_TOLERANCE'], type=float)
+
+        job_id = submit_job(
+            'upload', process_upload, path, filename, current_user.id,
+            full_points=full_points, tolerance=tolerance, compression=compression, file_hash=file_hash,
+            owner_id=current_user.id
+        )
+        logging.info(f'Загрузка {file.filename} поставлена в очередь как {job_id}.')
+
+        return jsonify({
+            'job_id': job_id,
+            'status_url': url_for('upload_status', job_id=job_id)
+        }), 202
 
     return jsonify({'error': 'Неверный формат файла'}), 400
 
 
+@app.route('/upload/status/<job_id>')
+@login_required
+def upload_status(job_id):
+    """Статус фоновой обработки загруженного трека."""
+    job = get_job(job_id)
+    if not job or job['kind'] != 'upload' or job['owner_id'] != current_user.id:
+        return jsonify({'error': 'Задача не найдена'}), 404
+
+    if job['status'] in ('queued', 'running'):
+        return jsonify({'job_id': job_id, 'status': job['status']}), 200
+
+    if job['status'] == 'failed':
+        return jsonify({'job_id': job_id, 'status': 'failed', 'error': f"Произошла ошибка: {job['error']}"}), 500
+
+    payload, status_code = job['result']
+    return jsonify({'job_id': job_id, 'status': 'done', **payload}), status_code
+
+
+def copy_and_hash(stream, target, chunk_size=64 * 1024):
+    """Копирует поток в файл и по ходу считает sha256 исходных байтов."""
+    digest = hashlib.sha256()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+        target.write(chunk)
+    return digest.hexdigest()
+
+
+def is_duplicate_track_error(error):
+    """IntegrityError из-за дубля трека (уникальные filename/content_hash/file_hash), а не NOT NULL или внешнего ключа."""
+    orig = getattr(error, 'orig', None)
+    if getattr(orig, 'errno', None) != MYSQL_DUPLICATE_ENTRY:
+        return False
+    message = str(orig)
+    return any(key in message for key in TRACK_UNIQUE_KEYS)
+
+
+def process_upload(path, filename, user_id, full_points=False, tolerance=None, compression=None, file_hash=None):
+    """Фоновая обработка загрузки: разбирает временный файл (распаковывая на лету) и удаляет его."""
+    try:
+        with open_gpx(path, compression) as source:
+            return process_gpx(source, filename, user_id, full_points, tolerance, file_hash)
+    finally:
+        os.remove(path)
+
+
+def process_gpx(source, filename, user_id, full_points=False, tolerance=None, file_hash=None):
+    """
+    Разбирает GPX, проверяет его и записывает трек в базу данных.
+    Возвращает пару (ответ, HTTP-статус) с теми же сообщениями, что и раньше отдавал /upload.
+    В ответ попадает упрощённая закодированная линия трека, а полный список точек — только при full_points.
+    """
+    try:
+        # Потоковый разбор GPX: точки приходят по одной, дерево не строится целиком,
+        # а все метрики считаются одним накопителем за тот же проход
+        tracks = []
+        metrics = TrackMetrics(app.config['TRACK_DISTANCE_METHOD'])
+        skipped_points = 0
+
+        for point in iter_trackpoints(source):
+            # Проверяем и добавляем данные в трек
+            if metrics.add(point):
+                if full_points:
+                    tracks.append(point)
+            else:
+                skipped_points += 1
+
+        # Логирование извлеченных треков (точки без времени — одной строкой, а не по каждой)
+        if skipped_points:
+            logging.info(f'{filename}: пропущено {skipped_points} точек без времени.')
+        logging.info(f'{filename}: извлечено {len(metrics)} точек.')
+
+        if not len(metrics):
+            logging.info(f'{filename}: в GPX-файле нет точек трека.')
+            return {'error': 'Не атрымалася загрузіць трэк.'}, 400
+
+        # Проверка на существование трека с таким же именем или с теми же точками (по хешу, до тяжёлых расчётов)
+        existing_track = Track.query.filter(
+            (Track.filename == filename) | (Track.content_hash == metrics.content_hash)
+        ).first()
+        if existing_track:
+            logging.info(f'Трек {filename} уже загружен (как {existing_track.filename}).')
+            return {'error': DUPLICATE_TRACK_ERROR}, 400
+
+        # Логика для записи в базу данных
+        summary = metrics.finish()
+        new_track = new_track_from_summary(filename, user_id, summary, file_hash)
+
+        # Сохранение трека в базу данных
+        try:
+            db.session.add(new_track)
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            if not is_duplicate_track_error(e):
+                logging.error(f'Ошибка целостности при сохранении трека {filename}: {e}')
+                return {'error': 'Ошибка при работе с базой данных.'}, 500
+            # Такой же трек успели записать параллельно
+            logging.info(f'Трек {filename} уже загружен параллельно.')
+            return {'error': DUPLICATE_TRACK_ERROR}, 400
+        logging.info(f'Трек {filename} сохранён в базе (id {new_track.id}).')
+        invalidate_daily_distances([user_id])
+
+        # Сохраняем сами точки, чтобы потом не просить пользователя загружать трек заново
+        try:
+            save_track_points(new_track.id, metrics.lats, metrics.lons, metrics.eles, metrics.epoch_seconds)
+        except OSError as e:
+            logging.error(f'Не удалось сохранить точки трека {new_track.id}: {e}')
+
+        if tolerance is None:
+            tolerance = app.config['POLYLINE_TOLERANCE']
+        polyline, polyline_points = simplified_polyline(metrics.lats, metrics.lons, tolerance)
+
+        response = {
+            'success': 'Трэк паспяхова запампаваны!',
+            'filename': filename,
+            'total_distance': new_track.distance,
+            'duration': new_track.duration,
+            'net_duration': new_track.net_duration,
+            'height': new_track.height,
+            'polyline': polyline,
+            'polyline_points': polyline_points,
+            'points_count': len(metrics)
+        }
+        if full_points:
+            response['tracks'] = tracks
+
+        return response, 200
+
+    except etree.XMLSyntaxError as e:
+        logging.warning(f'Ошибка парсинга GPX {filename}: {e}')
+        return {'error': f'Ошибка парсинга GPX: {str(e)}'}, 400
+    except DECOMPRESSION_ERRORS as e:
+        logging.warning(f'Повреждённый сжатый файл {filename}: {e}')
+        return {'error': f'Повреждённый сжатый файл: {str(e)}'}, 400
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f'Ошибка обработки трека {filename}: {e}', exc_info=True)
+        return {'error': f'Произошла ошибка: {str(e)}'}, 500
+
+
+
+
+def new_track_from_summary(filename, user_id, summary, file_hash=None):
+    """Создаёт (но не сохраняет) Track по итоговым метрикам GPX-файла."""
+    return Track(
+        user_id=user_id,  # Записываем user_id
+        filename=filename,
+        name_track=filename,
+        distance=round(summary['distance'], 2),
+        duration=format_duration(summary['duration']),  # Общее время
+        net_duration=format_duration(summary['net_duration']),  # Чистое время
+        upload_time=datetime.now(),
+        record_time=summary['record_time'],
+        height=round(summary['elevation_gain']),
+        content_hash=summary['content_hash'],
+        file_hash=file_hash
+    )
 
 
 def allowed_file(filename):
+    filename = strip_compression_suffix(filename)
     return '.' in filename and filename.rsplit('.', 1)[1].lower() == 'gpx'
 
 
-def calculate_distance(tracks):
-    total_distance = 0.0
-    previous_point = None
-
-    for track in tracks:
-        lat = float(track['lat'])
-        lon = float(track['lon'])
-        current_point = (lat, lon)
-
-        if previous_point:
-            total_distance += geodesic(previous_point, current_point).kilometers
-
-        previous_point = current_point
-
-    return total_distance
-
-
-def calculate_duration(tracks):
-    start_time = parse_time(tracks[0]['time'])
-    end_time = parse_time(tracks[-1]['time'])
-    return (end_time - start_time).total_seconds()
-
-
-def calculate_net_duration(tracks):
-    total_net_duration = 0
-    pause_threshold = 5  # порог паузы в секундах
-
-    # Сортируем трекпункты по времени
-    sorted_tracks = sorted(tracks, key=lambda x: parse_time(x['time']))
-
-    for i in range(1, len(sorted_tracks)):
-        current_time = parse_time(sorted_tracks[i]['time'])
-        previous_time = parse_time(sorted_tracks[i - 1]['time'])
-
-        # Рассчитываем разницу во времени между текущим и предыдущим трекпунктом
-        time_diff = (current_time - previous_time).total_seconds()
-
-        # Если разница меньше порога паузы, добавляем к чистому времени
-        if time_diff <= pause_threshold:
-            total_net_duration += time_diff
-
-    return timedelta(seconds=total_net_duration)
-
-
-def parse_time(time_string):
-    """Попробуйте разобрать строку времени в нескольких форматах."""
-    for fmt in ("%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ", "%Y-%m-%dT%H:%M:%S"):
-        try:
-            return datetime.strptime(time_string, fmt)
-        except ValueError:
-            continue
-    raise ValueError(f"Не удалось разобрать время: {time_string}")
-
-
 def format_duration(seconds):
     hours, remainder = divmod(seconds, 3600)
     minutes, seconds = divmod(remainder, 60)
@@ -3,6 +3,8 @@ from flask_login import login_required, current_user
 
 from kod import app, db
 from kod.models import Track
+from kod.track_points import delete_track_points
+from kod.challenges import invalidate_daily_distances
 
 import logging
 
@@ -35,6 +37,8 @@ def delete_track_user(track_id):
     # Удаляем трек из базы данных
     db.session.delete(track)
     db.session.commit()
+    delete_track_points(track_id)
+    invalidate_daily_distances([current_user.id])
     
     flash("Трэк паспяхова выдалены.", "success")
     logging.info('Трэк з ID %s паспяхова выдалены карыстальнікам %s.', track_id, current_user.login)